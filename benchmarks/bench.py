@@ -0,0 +1,322 @@
+"""
+Benchmarks of the overhead ffmpegp adds on top of ffmpeg.
+
+Inputs are generated with ffmpeg's lavfi test sources (testsrc + sine), so no sample
+files are needed. Every result is a time where lower is better.
+
+    python benchmarks/bench.py                          # run and print
+    python benchmarks/bench.py --save baseline.json     # store a baseline
+    python benchmarks/bench.py --compare baseline.json  # fail on regressions
+
+Compare baselines taken on the same machine only.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ffmpegp  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(name, unit):
+    def register(function):
+        BENCHMARKS[name] = (function, unit)
+        return function
+    return register
+
+
+class NullDisplay:
+    # Stands in for a ProgressBoard, so rendering is measured without terminal output
+    def update(self, key, text):
+        pass
+
+    def log(self, text):
+        pass
+
+    def finish(self, key, text=None):
+        pass
+
+
+def best_of(function, repeat=5):
+    return min(function() for _ in range(repeat))
+
+
+def per_call(function, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return (time.perf_counter() - start) / number
+
+
+def make_media(path, duration=5, size="320x240"):
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc=duration={duration}:size={size}:rate=25",
+        "-f", "lavfi", "-i", f"sine=duration={duration}",
+        "-c:v", "mpeg4", "-c:a", "aac", "-shortest", path,
+    ], check=True)
+
+
+def progress_lines(seconds=600):
+    # One -progress block per 0.5 seconds of output, like ffmpeg writes it
+    lines = []
+    for step in range(seconds * 2):
+        us = step * 500_000
+        lines += [
+            f"frame={step * 12}", "fps=240.0", "stream_0_0_q=2.0", "bitrate= 512.0kbits/s",
+            f"total_size={step * 32000}", f"out_time_us={us}", f"out_time_ms={us}",
+            f"out_time=00:{step // 120:02}:{step // 2 % 60:02}.{step % 2 * 5}00000",
+            "dup_frames=0", "drop_frames=0", "speed=9.6x", "progress=continue",
+        ]
+    lines[-1] = "progress=end"
+    return "\n".join(lines) + "\n", len(lines)
+
+
+def log_lines(count=5000):
+    lines = [f"frame={index} fps=240 q=2.0 size={index}kB time=00:00:{index % 60:02}.00 bitrate=512kbits/s speed=9.6x" for index in range(count)]
+    return "\n".join(lines) + "\n", count
+
+
+@benchmark("parse_progress_line", "us/line")
+def bench_parse_progress(context):
+    text, count = progress_lines()
+
+    def run():
+        state = ffmpegp.JobState(display=NullDisplay(), key=0)
+        state.total_duration = 600
+        state.start_time = time.time()
+        start = time.perf_counter()
+        ffmpegp.read_pipe(state, None, io.StringIO(text), [], ["input.mp4"], "", progress_pipe=True)
+        return (time.perf_counter() - start) / count * 1e6
+
+    return best_of(run)
+
+
+@benchmark("parse_log_line", "us/line")
+def bench_parse_log(context):
+    text, count = log_lines()
+
+    def run():
+        state = ffmpegp.JobState(display=NullDisplay(), key=0)
+        start = time.perf_counter()
+        ffmpegp.read_pipe(state, None, io.StringIO(text), [], ["input.mp4"], "")
+        return (time.perf_counter() - start) / count * 1e6
+
+    return best_of(run)
+
+
+@benchmark("extract_time", "us/call")
+def bench_extract_time(context):
+    line = "frame= 1500 fps=240 q=2.0 size=  4096kB time=00:01:00.00 bitrate= 512.0kbits/s speed=9.6x"
+    return best_of(lambda: per_call(lambda: ffmpegp.extract_time(line), 20000)) * 1e6
+
+
+def bench_render(pos_args):
+    state = ffmpegp.JobState(display=NullDisplay(), key=0)
+    suffix = ffmpegp.format_speed("9.6x", pos_args)
+    start_time = time.time()
+    iteration = [0]
+
+    def render():
+        # Reset the throttle, so every call renders
+        state.last_render = None
+        iteration[0] = (iteration[0] + 1) % 600
+        ffmpegp.print_progress_bar(state, start_time, iteration[0], 600, pos_args, prefix="01/10 ", suffix=suffix)
+
+    return best_of(lambda: per_call(render, 5000)) * 1e6
+
+
+@benchmark("render_progress_bar", "us/call")
+def bench_render_plain(context):
+    return bench_render([])
+
+
+@benchmark("render_progress_bar_colored", "us/call")
+def bench_render_colored(context):
+    return bench_render(["--colored"])
+
+
+@benchmark("gradient_text", "us/call")
+def bench_gradient_text(context):
+    colors = [(240, 120, 255), (255, 250, 100)]
+    return best_of(lambda: per_call(lambda: ffmpegp.gradient_text("speed:9.6x", colors), 5000)) * 1e6
+
+
+@benchmark("probe_uncached", "ms/file")
+def bench_probe_uncached(context):
+    path = context["media"][0]
+    return best_of(lambda: per_call(lambda: ffmpegp.get_media_details(path, use_cache=False, verbose=False), 10)) * 1e3
+
+
+@benchmark("probe_cached", "ms/file")
+def bench_probe_cached(context):
+    path = context["media"][0]
+    ffmpegp.get_media_details(path)
+    return best_of(lambda: per_call(lambda: ffmpegp.get_media_details(path), 200)) * 1e3
+
+
+@benchmark("probe_query_full", "ms/file")
+def bench_probe_query_full(context):
+    # What `--jq format.duration --no-cache` cost before queries were planned
+    path = context["media"][0]
+    return best_of(lambda: per_call(lambda: ffmpegp.query_json(ffmpegp.get_media_details(path, use_cache=False, verbose=False), "format.duration"), 10)) * 1e3
+
+
+@benchmark("probe_query_planned", "ms/file")
+def bench_probe_query_planned(context):
+    path = context["media"][0]
+    return best_of(lambda: per_call(lambda: ffmpegp.query_media(path, "format.duration", use_cache=False, verbose=False), 10)) * 1e3
+
+
+def run_cli(args, cwd):
+    # Run the checked out package, not an installed one
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "ffmpegp", *args], cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+@benchmark("wrapper_overhead", "ms/job")
+def bench_wrapper_overhead(context):
+    directory = context["directory"]
+    source = context["media"][0]
+    args = ["-i", source, "-c:v", "mpeg4", "-c:a", "aac", "-y", os.path.join(directory, "overhead.mkv")]
+
+    def bare():
+        start = time.perf_counter()
+        subprocess.run(["ffmpeg", "-v", "error", *args], check=True)
+        return time.perf_counter() - start
+
+    samples = [run_cli([*args, "--stdout"], directory) - bare() for _ in range(5)]
+    return statistics.median(samples) * 1e3
+
+
+def bench_batch(context, jobs):
+    directory = context["directory"]
+    output = os.path.join(directory, "batch_output")
+
+    def run():
+        shutil.rmtree(output, ignore_errors=True)
+        os.makedirs(output)
+        return run_cli(["-i", "{}", "-c:v", "mpeg4", "-c:a", "aac", "batch_output/{}.mkv", f"--dir={context['batch']}", f"--jobs={jobs}", "--stdout"], directory)
+
+    return best_of(run, repeat=3)
+
+
+@benchmark("batch_jobs_1", "s/batch")
+def bench_batch_1(context):
+    return bench_batch(context, 1)
+
+
+@benchmark("batch_jobs_2", "s/batch")
+def bench_batch_2(context):
+    return bench_batch(context, 2)
+
+
+@benchmark("batch_jobs_4", "s/batch")
+def bench_batch_4(context):
+    return bench_batch(context, 4)
+
+
+def get_ffmpeg_version():
+    result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    return result.stdout.split("\n", 1)[0].strip()
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\n{'benchmark':<30} {'baseline':>12} {'current':>12} {'change':>9}")
+
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous["value"]:
+            print(f"{name:<30} {'-':>12} {result['value']:>12.3f} {'new':>9}")
+            continue
+
+        change = result["value"] / previous["value"] - 1
+        print(f"{name:<30} {previous['value']:>12.3f} {result['value']:>12.3f} {change:>+9.1%}")
+        if change > tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of ffmpegp.")
+    parser.add_argument("--save", metavar="PATH", help="write the results to a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown against the baseline (default: 0.15)")
+    parser.add_argument("--only", metavar="NAME", nargs="+", help="run only these benchmarks")
+    parser.add_argument("--batch-files", type=int, default=8, help="number of files of the --dir benchmarks (default: 8)")
+    options = parser.parse_args()
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        sys.exit("ffmpeg and ffprobe have to be installed to run the benchmarks.")
+
+    names = options.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"unknown benchmarks: {', '.join(unknown)} (available: {', '.join(BENCHMARKS)})")
+
+    with tempfile.TemporaryDirectory(prefix="ffmpegp-bench-") as directory:
+        # Keep the user's metadata cache out of the measurements
+        os.environ["XDG_CACHE_HOME"] = os.path.join(directory, "cache")
+        ffmpegp.probe_cache = None
+
+        batch = os.path.join(directory, "batch")
+        os.makedirs(batch)
+        media = [os.path.join(batch, f"input{index:02}.mp4") for index in range(options.batch_files)]
+        for path in media:
+            make_media(path)
+
+        context = {"directory": directory, "batch": batch, "media": media}
+        results = {}
+        for name in names:
+            function, unit = BENCHMARKS[name]
+            value = function(context)
+            results[name] = {"value": value, "unit": unit}
+            print(f"{name:<30} {value:>12.3f} {unit}")
+
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.node(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": get_ffmpeg_version(),
+        },
+        "results": results,
+    }
+
+    if options.save:
+        with open(options.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+            file.write("\n")
+        print(f"\nbaseline saved to {options.save}")
+
+    if options.compare:
+        with open(options.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            print(f"\nslower than the baseline by more than {options.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
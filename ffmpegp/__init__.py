@@ -1,336 +1,2871 @@
 import os
 import re
 import sys
-import json
 import time
-import shutil
-import subprocess
+import functools
 import threading
-from jsonpath_ng import parse
+from collections import deque
 
-ffmpeg_path = shutil.which("ffmpeg")
-ffprobe_path = shutil.which("ffprobe")
-prev_bar_fill_length = None
+# json, subprocess, sqlite3 and jsonpath_ng are imported where they are used, so importing
+# ffmpegp stays cheap and free of side effects for library users.
+
+ffmpeg_path = None
+ffprobe_path = None
 input_filenames = []
-error = True
-stdline = []
+probe_cache = None
+
+CACHE_MAX_ENTRIES = 200_000
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Minimum time between two redraws of a progress bar (10 Hz)
+RENDER_INTERVAL = 0.1
+
+# Number of ffmpeg log lines kept in memory per job for error reports
+LOG_LINES = 500
+
+def check_binaries():
+    global ffmpeg_path, ffprobe_path
+    import shutil
+
+    ffmpeg_path = shutil.which("ffmpeg")
+    ffprobe_path = shutil.which("ffprobe")
+
+    if not ffmpeg_path:
+        print(f"'\33[92mffmpeg\33[0m' \33[91mis not installed. Cannot continue.\33[0m")
+        sys.exit(-1)
+
+    if ffmpeg_path and not ffprobe_path:
+        print(f"'\33[92mffprobe\33[0m' \33[91mis missing. Cannot continue.\33[0m")
+        sys.exit(-1)
+
+def get_cache_dir():
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "ffmpegp")
+
+@functools.lru_cache(maxsize=None)
+def get_ffprobe_version():
+    # Identify the ffprobe build by its binary, so reading the cache never has to run ffprobe
+    import shutil
+
+    path = shutil.which("ffprobe")
+    if not path:
+        return ""
+
+    try:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return ""
+
+class ProbeCache:
+    """
+    On-disk SQLite cache of ffprobe results.
+
+    Entries are keyed on (realpath, size, mtime_ns, ffprobe binary), so changed files and
+    upgraded ffprobe builds are probed again, plus the `-show_entries` selection of a planned
+    probe ("" for a full probe). Least recently used entries are evicted once the cache holds
+    more than `max_entries` results or `max_bytes` of JSON.
+
+    :param path: Path of the database file. (default: ~/.cache/ffmpegp/probe.sqlite3)
+    """
+
+    schema_version = 2
+
+    def __init__(self, path=None, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path or os.path.join(get_cache_dir(), "probe.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def connect(self):
+        # SQLite connections cannot be shared between threads, so every thread opens its own
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            import sqlite3
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.schema_version:
+                with conn:
+                    conn.execute("DROP TABLE IF EXISTS probe")
+                    conn.execute("""
+                        CREATE TABLE probe (
+                            path TEXT, size INTEGER, mtime_ns INTEGER, version TEXT,
+                            selection TEXT, data TEXT, accessed REAL,
+                            PRIMARY KEY (path, size, mtime_ns, version, selection)
+                        )
+                    """)
+                    conn.execute("CREATE INDEX probe_accessed ON probe (accessed)")
+                    conn.execute(f"PRAGMA user_version = {self.schema_version}")
+
+            self.local.conn = conn
+        return conn
+
+    def key(self, file_path):
+        path = os.path.realpath(file_path)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns, get_ffprobe_version()
+
+    def get(self, file_path, selections=("",)):
+        """
+        Look up a probe result, trying `selections` in order ("" is the full probe).
+        """
+
+        import json
+
+        key = self.key(file_path)
+        conn = self.connect()
+        row = None
+        for selection in selections:
+            row = conn.execute(
+                "SELECT data FROM probe WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ? AND selection = ?", (*key, selection)
+            ).fetchone()
+            if row is not None:
+                break
+
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if row is None:
+            return None
+
+        with conn:
+            conn.execute(
+                "UPDATE probe SET accessed = ? WHERE path = ? AND size = ? AND mtime_ns = ? AND version = ? AND selection = ?", (time.time(), *key, selection)
+            )
+        return json.loads(row[0])
+
+    def put(self, file_path, data, selection=""):
+        import json
+
+        key = self.key(file_path)
+        conn = self.connect()
+
+        with conn:
+            # Older entries of the same path can never match again
+            conn.execute("DELETE FROM probe WHERE path = ? AND NOT (size = ? AND mtime_ns = ? AND version = ?)", key)
+            conn.execute("INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, selection, json.dumps(data), time.time()))
+
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % 100 == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        conn = self.connect()
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM probe").fetchone()
+
+        excess = count - self.max_entries
+        if size > self.max_bytes:
+            excess = max(excess, count - int(count * self.max_bytes / size))
+
+        if excess > 0:
+            with conn:
+                conn.execute("DELETE FROM probe WHERE rowid IN (SELECT rowid FROM probe ORDER BY accessed LIMIT ?)", (excess,))
+
+    def stats(self):
+        conn = self.connect()
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM probe").fetchone()
+        return {
+            "path": self.path,
+            "entries": count,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+def get_probe_cache():
+    global probe_cache
+
+    if probe_cache is None:
+        probe_cache = ProbeCache()
+    return probe_cache
+
+def get_media_details(file_path, use_cache=True, verbose=True):
+    import json
+    import subprocess
+
+    cache = get_probe_cache() if use_cache else None
+
+    if cache:
+        try:
+            media_info = cache.get(file_path)
+            if media_info is not None:
+                return media_info
+        except Exception:
+            # A missing file, read-only cache directory or locked database simply skips the cache
+            cache = None
+
+    # Use ffprobe (a tool bundled with ffmpeg) to extract media details
+    command = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path
+    ]
+    
+    try:
+        # Run the command
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        
+        if result.returncode != 0:
+            if verbose:
+                print(f"Error occurred: {result.stderr}")
+            return None
+
+        # Parse the JSON result
+        media_info = json.loads(result.stdout)
+    
+    except Exception as e:
+        if verbose:
+            print(f"An error occurred: {e}")
+        return None
+
+    if cache:
+        try:
+            cache.put(file_path, media_info)
+        except Exception:
+            pass
+
+    return media_info
+
+def match_patterns(relative_path, patterns):
+    from fnmatch import fnmatch
+
+    name = os.path.basename(relative_path)
+    # Patterns without a directory part are matched against the file name only
+    return any(fnmatch(relative_path, pattern) or ("/" not in pattern and fnmatch(name, pattern)) for pattern in patterns)
+
+def iter_media_files(directory, formats=None, recursive=False, include=None, exclude=None, skip_dirs=None):
+    """
+    Lazily yield files of a directory with os.scandir.
+
+    :param directory: Directory to scan.
+    :param formats: Optional list of file extensions to keep.
+    :param recursive: Descend into subdirectories.
+    :param include: Glob patterns a file must match (relative path or file name).
+    :param exclude: Glob patterns of files and directories to skip.
+    :param skip_dirs: Absolute directory paths that are never entered.
+    """
+
+    skip_dirs = set(skip_dirs or [])
+    stack = [directory]
+
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+
+        with entries:
+            subdirectories = []
+            for entry in entries:
+                relative_path = os.path.relpath(entry.path, directory).replace(os.sep, "/")
+
+                if exclude and match_patterns(relative_path, exclude):
+                    continue
+
+                if entry.is_dir():
+                    if recursive and os.path.abspath(entry.path) not in skip_dirs:
+                        subdirectories.append(entry.path)
+                    continue
+
+                if not entry.is_file():
+                    continue
+                if formats and not any(entry.name.endswith(fmt) for fmt in formats):
+                    continue
+                if include and not match_patterns(relative_path, include):
+                    continue
+
+                yield entry.path
+
+        # Keep a depth-first order close to the listing order
+        stack.extend(reversed(subdirectories))
+
+def iter_probe_paths(target, formats=None, recursive=False, include=None, exclude=None):
+    """
+    Lazily yield media files from a directory or a glob pattern.
+
+    :param target: A directory (its files are probed) or a glob pattern such as "archive/**/*.mxf".
+    :param formats: Optional list of file extensions to keep.
+    :param recursive: Descend into subdirectories of a directory target.
+    :param include: Glob patterns a file of a directory target must match.
+    :param exclude: Glob patterns of files and directories to skip in a directory target.
+    """
+
+    if os.path.isdir(target):
+        yield from iter_media_files(target, formats, recursive=recursive, include=include, exclude=exclude)
+        return
+
+    import glob
+
+    for path in glob.iglob(target, recursive=True):
+        if os.path.isfile(path) and (not formats or any(path.endswith(fmt) for fmt in formats)):
+            yield path
+
+def probe_files(paths, max_jobs, json_path=None, use_cache=True, stream=None):
+    """
+    Probe files concurrently and write one JSON record per line as each probe finishes.
+
+    At most `max_jobs` ffprobe processes run at once and only a small window of paths is
+    pulled from `paths` ahead of them, so arbitrarily large trees are streamed.
+
+    :param paths: An iterable of file paths.
+    :param max_jobs: Maximum number of concurrent ffprobe processes.
+    :param json_path: Optional JSON path applied to each record.
+    :param use_cache: Use the on-disk metadata cache.
+    :param stream: Output stream. (default: sys.stdout)
+    :return: The number of records written.
+    """
+
+    import json
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    stream = stream or sys.stdout
+    count = 0
+
+    def probe(path):
+        if json_path:
+            return path, query_media(path, json_path, use_cache=use_cache, verbose=False)
+        return path, get_media_details(path, use_cache=use_cache, verbose=False)
+
+    def write(future):
+        path, details = future.result()
+        if details is None:
+            record = {"file": path, "error": "ffprobe failed"}
+        elif json_path:
+            record = {"file": path, "result": details or None}
+        else:
+            record = {"file": path, "data": details}
+
+        stream.write(json.dumps(record) + "\n")
+        stream.flush()
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        pending = set()
+
+        for path in paths:
+            pending.add(executor.submit(probe, path))
+
+            if len(pending) >= max_jobs * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future)
+                    count += 1
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(future)
+                count += 1
+
+    return count
+
+def print_cache_stats(pos_args):
+    import json
+
+    try:
+        stats = get_probe_cache().stats()
+    except Exception as e:
+        print(f"Cache is not available: {e}")
+        return
+
+    if os.path.exists(stats["path"]):
+        size = get_readable_file_size(stats["path"])
+    else:
+        size = "0.00 B"
+
+    if "--stdout" in pos_args:
+        print(json.dumps({**stats, "file_size": size}))
+    else:
+        print(f"\33[92mcache\33[0m:    {stats['path']} ({size})")
+        print(f"\33[92mentries\33[0m:  {stats['entries']}")
+        print(f"\33[92mhits\33[0m:     {stats['hits']}")
+        print(f"\33[92mmisses\33[0m:   {stats['misses']}")
+
+simple_path_pattern = r"^(?:\$\.)?[A-Za-z_][\w-]*(?:\[\d+\])*(?:\.[A-Za-z_][\w-]*(?:\[\d+\])*)*$"
+simple_token_pattern = r"([^.\[\]]+)|\[(\d+)\]"
+
+def find_simple_path(json_data, tokens):
+    value = json_data
+    for token in tokens:
+        if isinstance(token, int):
+            if not isinstance(value, list) or token >= len(value):
+                return []
+        elif not isinstance(value, dict) or token not in value:
+            return []
+        value = value[token]
+    return [value]
+
+@functools.lru_cache(maxsize=256)
+def compile_json_path(json_path):
+    """
+    Compile a JSON path into a function returning the list of matched values.
+
+    Plain dotted paths with optional list indexes (e.g. "format.duration" or
+    "streams[0].codec_name") are resolved directly; everything else is parsed once
+    with jsonpath_ng. Compiled expressions are memoized.
+    """
+
+    if re.match(simple_path_pattern, json_path):
+        path = json_path[2:] if json_path.startswith("$.") else json_path
+        tokens = tuple(int(index) if index else name for name, index in re.findall(simple_token_pattern, path))
+        return functools.partial(find_simple_path, tokens=tokens)
+
+    # Importing jsonpath_ng builds its grammar, so only pay for it when a real expression is used
+    from jsonpath_ng import parse
+
+    jsonpath_expr = parse(json_path)
+    return lambda json_data: [match.value for match in jsonpath_expr.find(json_data)]
+
+def query_json(json_data, json_path):
+    try:
+        # Parse and apply the JSON path query
+        find = compile_json_path(json_path)
+        result = find(json_data)
+        return result if result else None
+    except Exception as e:
+        print(f"Invalid JSON path or error: {e}")
+        return None
+
+# Format entries that ffprobe reads from the container header, without analysing streams
+HEADER_FORMAT_ENTRIES = {"filename", "size", "format_name", "format_long_name", "tags"}
+
+@functools.lru_cache(maxsize=256)
+def plan_probe(json_path):
+    """
+    Turn a JSON path into the smallest ffprobe query that can answer it.
+
+    Only plain dotted paths under "format" and "streams" are mapped, to a `-show_entries`
+    selection that keeps the layout of the full probe, so the same path applies to the
+    result. Header-only format entries also get small `-probesize`/`-analyzeduration`
+    limits, since they do not depend on stream analysis.
+
+    :return: A list of ffprobe arguments, or None when the path needs a full probe.
+    """
+
+    if not re.match(simple_path_pattern, json_path):
+        return None
+
+    path = json_path[2:] if json_path.startswith("$.") else json_path
+    names = [name for name, _ in re.findall(simple_token_pattern, path) if name]
+    section, key, subkey = (names + [None, None])[:3]
+
+    if section == "format":
+        if key is None:
+            entries = "format"
+        elif key == "tags":
+            entries = f"format_tags={subkey}" if subkey else "format_tags"
+        else:
+            entries = f"format={key}"
+
+        limits = ["-probesize", "32768", "-analyzeduration", "0"] if key in HEADER_FORMAT_ENTRIES else []
+        return [*limits, "-show_entries", entries]
+
+    if section == "streams":
+        if key is None:
+            entries = "stream"
+        elif key in ("tags", "disposition"):
+            entries = f"stream_{key}={subkey}" if subkey else f"stream_{key}"
+        else:
+            entries = f"stream={key}"
+        return ["-show_entries", entries]
+
+    return None
+
+def query_media(file_path, json_path, use_cache=True, verbose=True):
+    """
+    Answer a JSON path query about a media file with as little probing as possible.
+
+    A cached full probe, or a cached result of the same planned probe, is used when there
+    is one. Otherwise the query is planned with plan_probe() and ffprobe only reads and
+    prints the requested entries, which are cached under their `-show_entries` selection;
+    paths that cannot be planned, and planned probes without a result, fall back to the
+    full (cached) probe of get_media_details().
+
+    :return: The list of matched values (empty without a match), or None if the file could not be probed.
+    """
+
+    import json
+    import subprocess
+
+    plan = plan_probe(json_path)
+    # The probe limits do not change the selected entries, so they are not part of the key
+    selection = plan[plan.index("-show_entries") + 1] if plan else None
+    cache = get_probe_cache() if use_cache else None
+
+    if cache:
+        try:
+            media_info = cache.get(file_path, ("", selection) if selection else ("",))
+            # Planned results are only stored when they answer the query
+            if media_info is not None:
+                return query_json(media_info, json_path) or []
+        except Exception:
+            cache = None
+
+    if plan:
+        command = ['ffprobe', '-v', 'quiet', '-print_format', 'json', *plan, file_path]
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if result.returncode == 0:
+                media_info = json.loads(result.stdout)
+                query_result = query_json(media_info, json_path)
+                if query_result:
+                    if cache:
+                        try:
+                            cache.put(file_path, media_info, selection)
+                        except Exception:
+                            pass
+                    return query_result
+        except Exception:
+            pass
+
+    media_info = get_media_details(file_path, use_cache=use_cache, verbose=verbose)
+    if media_info is None:
+        return None
+    return query_json(media_info, json_path) or []
+
+def extract_output(path) -> str:
+    output_filename, output_extension = os.path.splitext(path)
+    output_directory, output_template = os.path.split(output_filename)
+    return output_directory, output_filename, output_template, output_extension
+
+def resolve_output(output_filename, input_path):
+    # Replace the `{}` placeholder of an output template with the input file name
+    if "{}" not in output_filename:
+        return output_filename
+
+    output_directory, _, output_template, output_extension = extract_output(output_filename)
+    file_name, input_extension = os.path.splitext(os.path.basename(input_path))
+    return os.path.join(output_directory, output_template.replace("{}", file_name) + (output_extension or input_extension))
+
+def parse_outputs(value):
+    """
+    Parse the `--outputs` list of output templates with optional per-output arguments.
+
+    Outputs are separated by commas, arguments follow in square brackets, where commas
+    are kept (e.g. "1080p.mp4[-vf scale=-2:1080,fps=30 -b:v 5M],720p.mp4").
+
+    :return: A list of (output template, argument list) tuples.
+    """
+
+    import shlex
+
+    outputs = []
+    current = ""
+    depth = 0
+    for char in value + ",":
+        if char == "," and depth == 0:
+            if current.strip():
+                template, _, output_args = current.strip().partition("[")
+                outputs.append((template.strip(), shlex.split(output_args.rstrip().removesuffix("]"))))
+            current = ""
+            continue
+
+        depth += {"[": 1, "]": -1}.get(char, 0)
+        current += char
+    return outputs
+
+def build_output_args(args, outputs, split_video=True):
+    """
+    Build the arguments of a single ffmpeg call writing several outputs.
+
+    The input is decoded once. When outputs have their own video filters, the decoded
+    video is fanned out with the `split` filter to one filter chain per output, and
+    every output maps its chain together with all audio streams. ffmpeg applies output
+    options to the next output only, so options after the last input are repeated for
+    every output.
+
+    :param args: Arguments shared by all outputs (inputs and common output options).
+    :param outputs: A list of (output path, argument list) tuples.
+    :param split_video: Build a `split` filter graph for per-output video filters.
+    """
+
+    last_input = max(index for index, arg in enumerate(args[:-1]) if arg == "-i") + 2
+    args, shared_args = args[:last_input], args[last_input:]
+    outputs = [(path, shared_args + output_args) for path, output_args in outputs]
+
+    filter_keys = ("-vf", "-filter:v")
+    output_filters = []
+    for _, output_args in outputs:
+        filters = [output_args[index + 1] for index, arg in enumerate(output_args[:-1]) if arg in filter_keys]
+        output_filters.append(filters[-1] if filters else None)
+
+    # Explicit mappings and filter graphs are left to the user
+    all_args = args + [arg for _, output_args in outputs for arg in output_args]
+    if not split_video or not any(output_filters) or any(arg in ("-filter_complex", "-lavfi", "-map") for arg in all_args):
+        return args + [arg for path, output_args in outputs for arg in [*output_args, path]]
+
+    labels = "".join(f"[s{index}]" for index in range(len(outputs)))
+    chains = ";".join(f"[s{index}]{output_filter or 'null'}[v{index}]" for index, output_filter in enumerate(output_filters))
+    new_args = args + ["-filter_complex", f"[0:v]split={len(outputs)}{labels};{chains}"]
+
+    for index, (path, output_args) in enumerate(outputs):
+        other_args = []
+        skip = False
+        for arg in output_args:
+            if skip:
+                skip = False
+            elif arg in filter_keys:
+                skip = True
+            else:
+                other_args.append(arg)
+        new_args += ["-map", f"[v{index}]", "-map", "0:a?", *other_args, path]
+    return new_args
+
+THUMBNAIL_WIDTH = 160
+
+# Keyframes are close enough to the requested timestamps from this interval (in seconds) on
+KEYFRAME_THUMBNAIL_INTERVAL = 10
+
+def get_thumbnail_layout(opt_args):
+    """
+    Read '--thumbnails N' and '--sprite COLUMNSxROWS' into (count, columns, rows).
+
+    Either option alone is enough: N thumbnails are laid out in a near square grid, and a
+    grid alone is filled completely. Returns None when neither option is given.
+    """
+
+    count = get_opt(opt_args, "--thumbnails")
+    sprite = get_opt(opt_args, "--sprite")
+    if not count and not sprite:
+        return None
+
+    try:
+        count = int(count) if count else None
+    except ValueError:
+        print(f"provided '--thumbnails' value '{count}' is not a number.")
+        sys.exit(1)
+
+    columns = rows = None
+    if sprite:
+        match = re.fullmatch(r"(\d+)x(\d+)", sprite)
+        if not match or not int(match.group(1)) or not int(match.group(2)):
+            print(f"provided '--sprite' value '{sprite}' is not a grid like 5x4.")
+            sys.exit(1)
+        columns, rows = int(match.group(1)), int(match.group(2))
+
+    if count is None:
+        count = columns * rows
+    elif count < 1:
+        print("provided '--thumbnails' value has to be at least 1.")
+        sys.exit(1)
+    elif columns is None:
+        columns = next(columns for columns in range(1, count + 1) if columns * columns >= count)
+        rows = -(-count // columns)
+    elif count > columns * rows:
+        print(f"{count} thumbnails do not fit in a {columns}x{rows} sprite.")
+        sys.exit(1)
+
+    return count, columns, rows
+
+def get_thumbnail_size(media_details, width=THUMBNAIL_WIDTH):
+    # Height of a thumbnail `width` pixels wide, following the displayed (rotated, SAR corrected) picture
+    video = next((stream for stream in media_details.get("streams", []) if stream.get("codec_type") == "video" and not stream.get("disposition", {}).get("attached_pic")), None)
+    if not video or not video.get("width") or not video.get("height"):
+        return None
+
+    frame_width, frame_height = video["width"], video["height"]
+    try:
+        numerator, denominator = map(int, video.get("sample_aspect_ratio", "1:1").split(":"))
+        frame_width = frame_width * numerator / denominator if numerator and denominator else frame_width
+    except ValueError:
+        pass
+
+    rotation = video.get("tags", {}).get("rotate") or next((data.get("rotation") for data in video.get("side_data_list", []) if "rotation" in data), 0)
+    if abs(int(float(rotation))) % 180 == 90:
+        frame_width, frame_height = frame_height, frame_width
+
+    return width, max(2, round(width * frame_height / frame_width / 2) * 2)
+
+def build_thumbnail_args(args, media_details, count, columns, rows):
+    """
+    Turn the arguments of a job into one ffmpeg call writing a sprite sheet of thumbnails.
+
+    The duration is cut into `count` equal intervals and the first frame from the middle
+    of each interval on is picked with the `select` filter, scaled and placed with `tile`.
+    For long intervals only keyframes are decoded (`-skip_frame nokey`), which is much
+    faster and still close to the requested timestamps. A video filter of the job is
+    applied to the picked frames only.
+
+    :param args: ffmpeg arguments of the job with a single input, the sprite image path last.
+    :param media_details: ffprobe data of the input (see get_media_details).
+    :return: (arguments, WebVTT index text), or None when the input has no video or duration.
+    """
+
+    media_format = media_details.get("format", {}) if media_details else {}
+    size = get_thumbnail_size(media_details) if media_details else None
+    try:
+        duration = float(media_format["duration"])
+    except (KeyError, ValueError):
+        return None
+    if not size or duration <= 0:
+        return None
+
+    try:
+        start = float(media_format.get("start_time", 0))
+    except ValueError:
+        start = 0
+
+    width, height = size
+    interval = duration / count
+    filters = []
+    job_args = []
+    skip = False
+    for index, arg in enumerate(args[:-1]):
+        if skip:
+            skip = False
+        elif arg in ("-vf", "-filter:v") and index + 1 < len(args) - 1:
+            filters.append(args[index + 1])
+            skip = True
+        else:
+            job_args.append(arg)
+
+    if interval >= KEYFRAME_THUMBNAIL_INTERVAL:
+        job_args.insert(job_args.index("-i"), "-skip_frame")
+        job_args.insert(job_args.index("-i"), "nokey")
+
+    select = f"select='lt(selected_n\\,{count})*gte(t\\,{start:.3f}+{interval:.3f}*(selected_n+0.5))'"
+    chain = ",".join([select, *filters, f"scale={width}:{height}", f"tile={columns}x{rows}"])
+    job_args += ["-vf", chain, "-frames:v", "1", "-update", "1", "-an", "-sn", args[-1]]
+
+    def timestamp(seconds):
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return f"{int(hours):02}:{int(minutes):02}:{seconds:06.3f}"
+
+    image = os.path.basename(args[-1])
+    cues = ["WEBVTT", ""]
+    for index in range(count):
+        x, y = index % columns * width, index // columns * height
+        cues += [f"{timestamp(index * interval)} --> {timestamp(min(duration, (index + 1) * interval))}", f"{image}#xywh={x},{y},{width},{height}", ""]
+
+    return job_args, "\n".join(cues)
+
+def write_thumbnail_index(image_path, text):
+    # The WebVTT index sits next to its sprite, which it references by file name
+    vtt_path = os.path.splitext(image_path)[0] + ".vtt"
+    with open(vtt_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    return vtt_path
+
+@functools.lru_cache(maxsize=128)
+def gradient_palette(length, colors):
+    """
+    Escape codes coloring each of `length` characters along the given gradients.
+
+    Palettes only depend on the text length, so they are computed once per length
+    and reused for every redraw of a progress bar.
+
+    :param length: Number of characters.
+    :param colors: A tuple of RGB tuples.
+    :return: A tuple with one escape code per character.
+    """
+
+    palette = []
+    num_segments = len(colors) - 1
+    segment_length = length // num_segments
+    remainder = length % num_segments
+
+    # Generate the gradient for each segment
+    for segment_index in range(num_segments):
+        start_color = colors[segment_index]
+        end_color = colors[segment_index + 1]
+        segment_size = segment_length + (1 if segment_index < remainder else 0)
+
+        if segment_size > 1:
+            step = [(end_color[i] - start_color[i]) / (segment_size - 1) for i in range(3)]
+        else:
+            step = [0, 0, 0]  # No transition needed if only one character in this segment
+
+        for i in range(segment_size):
+            r = int(start_color[0] + step[0] * i)
+            g = int(start_color[1] + step[1] * i)
+            b = int(start_color[2] + step[2] * i)
+            palette.append(f'\033[38;2;{r};{g};{b}m')
+
+    return tuple(palette)
+
+def gradient_text(word, colors):
+    """
+    Apply multiple gradients to the given text.
+
+    :param word: The word to apply the gradient to.
+    :param colors: A list of tuples, each representing an RGB color for the gradients.
+    :return: A string with the text colored according to the gradients.
+    """
+
+    if len(word) < 2 or len(colors) < 2:
+        color = list(map(str, colors[0]))
+        return f'\033[38;2;{";".join(color)}m{word}\033[0m'
+
+    palette = gradient_palette(len(word), tuple(colors))
+    return "".join(f'{code}{char}\033[0m' for code, char in zip(palette, word))
+
+@functools.lru_cache(maxsize=1024)
+def strip_ansi(text):
+    return re.sub(r'\x1B\[[^m]*m', '', text)
+
+def duration_to_seconds(duration):
+    h, m, s = map(float, duration.split(':'))
+    return h * 3600 + m * 60 + s
+
+def extract_time(log_line):
+    # Define the regular expression pattern to extract the time
+    time_pattern = r"time=(\d{2}:\d{2}:\d{2}\.\d{2})"
+    
+    # Search for the pattern in the log line
+    match = re.search(time_pattern, log_line)
+    
+    # If a match is found, return the extracted time
+    if match:
+        return match.group(1)
+    else:
+        return "N/A"
+
+def get_readable_file_size(file_path):
+    size_bytes = os.path.getsize(file_path)
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024:
+            return f"{size_bytes:.2f} {unit}"
+        size_bytes /= 1024
+
+class ProgressBoard:
+    """
+    Multi-line progress display shared by concurrently running jobs.
+
+    Every running job owns one line at the bottom of the terminal. Finished
+    jobs and log messages are printed above the board, which is then redrawn.
+
+    :param plain: Skip cursor movement and only print finished lines (used with '--stdout').
+    """
+
+    def __init__(self, plain=False):
+        self.plain = plain
+        self.lines = {}
+        self.drawn = 0
+        self.last_redraw = 0
+        self.lock = threading.Lock()
+
+    def _redraw(self, above=()):
+        output = ""
+        if not self.plain:
+            if self.drawn:
+                # Move to the first line of the board and clear everything below it
+                output += f"\33[{self.drawn}F"
+            output += "\33[J"
+
+        for text in above:
+            output += f"{text}\n"
+
+        if not self.plain:
+            for text in self.lines.values():
+                output += f"{text}\n"
+            self.drawn = len(self.lines)
+
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        self.last_redraw = time.time()
+
+    def update(self, key, text):
+        with self.lock:
+            self.lines[key] = text
+            # Every job is already throttled, this keeps many jobs from adding up
+            if not self.plain and time.time() - self.last_redraw >= RENDER_INTERVAL:
+                self._redraw()
+
+    def finish(self, key, text=None):
+        with self.lock:
+            line = self.lines.pop(key, None)
+            above = [text] if text else [line] if line else []
+            self._redraw(above)
+
+    def log(self, text):
+        with self.lock:
+            self._redraw([text])
+
+    def prompt(self, question):
+        # Ask below the finished lines while running jobs wait for the board
+        with self.lock:
+            if not self.plain and self.drawn:
+                sys.stdout.write(f"\33[{self.drawn}F\33[J")
+                self.drawn = 0
+            try:
+                return input(question)
+            finally:
+                self._redraw()
+
+class LogFile:
+    """
+    Log file receiving the complete ffmpeg log of every job of a run.
+
+    :param path: File to append to.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, line, prefix=''):
+        with self.lock:
+            self.file.write(f"{prefix}{line}\n")
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class JobState:
+    """
+    State of a single ffmpeg process, shared by its pipe readers.
+
+    Only the last `log_lines` log lines are kept in memory; the full log can be
+    streamed to a LogFile instead.
+
+    :param display: Optional ProgressBoard to render into, otherwise the progress bar is written to stdout.
+    :param key: Line key of this job on the board.
+    :param log_lines: Number of log lines kept for error reports.
+    :param log_file: Optional LogFile receiving every log line.
+    :param log_prefix: Prefix of this job's lines in the log file.
+    """
+
+    def __init__(self, display=None, key=None, log_lines=LOG_LINES, log_file=None, log_prefix=''):
+        self.error = True
+        self.stdline = deque(maxlen=log_lines)
+        self.log_file = log_file
+        self.log_prefix = log_prefix
+        self.prev_bar_fill_length = None
+        self.process = None
+        self.stages = []
+        self.parser = ProgressParser()
+        self.start_time = None
+        self.total_duration = None
+        self.stats = {}
+        self.suffix = ''
+        self.progress = None
+        self.last_render = None
+        self.on_progress = None
+        self.command_prefix = []
+        # Jobs running next to others (or to prompts) must not read the terminal
+        self.batch = False
+        # get_output_stat() of the output before a batch job ran
+        self.output_stat = None
+        self.metrics = None
+        # Output paths of jobs writing several outputs, otherwise the last argument is the output
+        self.outputs = None
+        self.returncode = None
+        self.end_time = None
+        self.peak_rss = None
+        self.host = None
+        self.ssh_command = None
+        self.remote_cwd = None
+        self.display = display
+        self.key = key
+
+    def reset(self):
+        # Start over for another attempt of the same job
+        self.error = True
+        self.stdline.clear()
+        self.prev_bar_fill_length = None
+        self.process = None
+        self.stages = []
+        self.parser = ProgressParser()
+        self.stats = {}
+        self.suffix = ''
+        self.progress = None
+        self.last_render = None
+
+    def write(self, bar_fill, bar_fill_length, final=False):
+        if self.display:
+            self.display.update(self.key, bar_fill)
+            return
+
+        if final or (self.prev_bar_fill_length is not None and bar_fill_length != self.prev_bar_fill_length):
+            sys.stdout.write("\r" + " " * (self.prev_bar_fill_length or bar_fill_length))
+        self.prev_bar_fill_length = bar_fill_length
+
+        sys.stdout.write(f'\r' + bar_fill)
+
+    def add_line(self, text):
+        self.stdline.append(text)
+        if self.log_file:
+            self.log_file.write(text, self.log_prefix)
+
+    def log(self, text):
+        if self.display:
+            self.display.log(text)
+        else:
+            print(text)
+
+    def finish(self, text=None):
+        if self.display:
+            self.display.finish(self.key, text)
+        elif text:
+            print(text)
+        else:
+            print()
+
+def print_progress_bar(state, start_time, iteration, total, pos_args, prefix='', suffix='', done='Complete', decimals=1, length=30, fill='━'):
+    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
+    complete = iteration == total or int(round(float(percent), 0)) == 100
+
+    # Limit redraws to RENDER_INTERVAL, the final state is always drawn
+    now = time.time()
+    if not complete and state.last_render is not None and now - state.last_render < RENDER_INTERVAL:
+        return None
+    state.last_render = now
+
+    # Visible width of the suffix, without its color codes
+    suffix_text = strip_ansi(suffix)
+
+    if suffix:
+        suffix = f"| {suffix} |"
+    else:
+        suffix = "|"
+
+    done_width = len(done) + 4 if done else 1
+    if done:
+        if "--colored" in pos_args:
+            colors = [(255, 255, 100), (100, 200, 255)] # Yellow -> Cyan
+            done = f"| {gradient_text(done, colors)} |"
+        else:
+            done = f"| \33[92m{done}\33[0m |"
+    else:
+        done = "|"
+
+    color = "\33[93m"
+    filled_length = int(length * iteration // total)
+
+    # Calculate elapsed time
+    elapsed_time = now - start_time
+
+    # Format the difference as HH:MM:SS
+    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+    time_width = len(formatted_time)
+
+    if "--stdout" in pos_args:
+        if complete:
+            percent = "100"
+        bar_fill = f"{prefix}progress={percent}% {suffix_text} time={formatted_time}"
+        state.write(bar_fill, len(bar_fill), final=complete)
+        return "OK" if complete else None
+
+    if "--colored" in pos_args:
+        colors = [(100, 200, 255), (255, 255, 100)]  # Cyan -> Yellow
+        formatted_time = gradient_text(formatted_time, colors)
+        colors = [(100, 200, 255), (255, 100, 255), (255, 255, 100)]  # Cyan -> Pink -> Yellow
+    elif float(percent) >= 30:
+        color = "\33[92m"
+    formatted_time = formatted_time if "--colored" in pos_args else f"\33[96m{formatted_time}\33[0m"
+
+    # Print the finished bar on complete
+    if complete:
+        if "--colored" in pos_args:
+            bar = gradient_text(fill * length, colors)
+        else:
+            bar = f"{color}{fill}\33[0m" * length
+
+        bar_fill = f"{prefix}{bar} 100% {done} {formatted_time}"
+        bar_fill_length = len(prefix) + length + len(" 100% ") + done_width + 1 + time_width
+        state.write(bar_fill, bar_fill_length, final=True)
+        return "OK"
+
+    if "--colored" in pos_args:
+        bar = f"{gradient_text(fill * filled_length, colors)}" + f'\33[90m{fill}\33[0m' * (length - filled_length)
+    else:
+        bar = f"{color}{fill * filled_length}" + f'\33[90m{fill}\33[0m' * (length - filled_length)
+
+    bar_fill = f"{prefix}{bar} {percent}% {suffix} {formatted_time}"
+    suffix_width = len(suffix_text) + 4 if suffix_text else 1
+    bar_fill_length = len(prefix) + length + len(f" {percent}% ") + suffix_width + 1 + time_width
+    state.write(bar_fill, bar_fill_length)
+
+def get_file_fingerprint(file_path, sample_size=1024 * 1024):
+    """
+    Cheap content fingerprint of a (large) media file.
+
+    Hashes the size, modification time and the first and last `sample_size` bytes
+    instead of reading the whole file.
+    """
+
+    import hashlib
+
+    stat = os.stat(file_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    with open(file_path, "rb") as file:
+        digest.update(file.read(sample_size))
+        if stat.st_size > sample_size:
+            file.seek(max(sample_size, stat.st_size - sample_size))
+            digest.update(file.read(sample_size))
+
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    Persistent record of finished jobs, stored as JSON lines.
+
+    Every successful job appends {"key", "input", "output", "size"}, where `key` hashes the
+    input fingerprint together with the ffmpeg arguments. A job is done when its key is
+    recorded and the output still has the recorded size, so changed inputs, changed
+    options and outputs of interrupted runs are encoded again.
+
+    :param path: Manifest file, created on the first finished job.
+    """
+
+    def __init__(self, path):
+        import json
+
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+                    except (ValueError, KeyError, TypeError):
+                        # A line cut short by a crash
+                        continue
+
+    def key(self, input_path, args):
+        import json
+        import hashlib
+
+        return hashlib.sha1(json.dumps([get_file_fingerprint(input_path), args]).encode()).hexdigest()
+
+    def is_done(self, key, output_path):
+        entry = self.entries.get(key)
+        return bool(entry) and os.path.isfile(output_path) and os.path.getsize(output_path) == entry["size"]
+
+    def record(self, key, input_path, output_path):
+        import json
+
+        entry = {
+            "key": key,
+            "input": os.path.abspath(input_path),
+            "output": os.path.abspath(output_path),
+            "size": os.path.getsize(output_path),
+        }
+
+        with self.lock:
+            self.entries[key] = entry
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+class WatchQueue:
+    """
+    Persistent queue of watch mode, stored in SQLite.
+
+    Files are keyed on their path and remember size and mtime, so a file is queued again
+    when it is replaced. Jobs that were running when the daemon stopped are pending
+    again on the next start.
+
+    :param path: Database file, created if missing.
+    """
+
+    schema_version = 1
+
+    def __init__(self, path):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.schema_version:
+            self.db.execute("DROP TABLE IF EXISTS queue")
+            self.db.execute(f"PRAGMA user_version={self.schema_version}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, state TEXT, added REAL)"
+        )
+        self.db.execute("UPDATE queue SET state = 'pending' WHERE state = 'running'")
+        self.db.commit()
+
+    def add(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        row = self.db.execute("SELECT size, mtime_ns FROM queue WHERE path = ?", (path,)).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return False
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO queue (path, size, mtime_ns, state, added) VALUES (?, ?, ?, 'pending', ?)",
+            (path, stat.st_size, stat.st_mtime_ns, time.time()),
+        )
+        self.db.commit()
+        return True
+
+    def take(self):
+        # Pending files in arrival order, marked as running
+        paths = [row[0] for row in self.db.execute("SELECT path FROM queue WHERE state = 'pending' ORDER BY added")]
+        self.db.executemany("UPDATE queue SET state = 'running' WHERE path = ?", [(path,) for path in paths])
+        self.db.commit()
+        return paths
+
+    def finish(self, path, ok):
+        self.db.execute("UPDATE queue SET state = ? WHERE path = ?", ("done" if ok else "failed", path))
+        self.db.commit()
+
+    def record_output(self, path):
+        # Outputs written into the watched directory are known, so add() ignores them after a restart too
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO queue (path, size, mtime_ns, state, added) VALUES (?, ?, ?, 'output', ?)",
+            (path, stat.st_size, stat.st_mtime_ns, time.time()),
+        )
+        self.db.commit()
+
+class DirectoryWatcher:
+    """
+    Reports files of a directory once they are complete.
+
+    Changes are taken from inotify on Linux and from periodic scans elsewhere, or when
+    inotify is not usable (e.g. the watch limit is reached). A changed file is reported
+    after its size and mtime stayed the same for `settle` seconds, so files that are still
+    being copied in are not picked up early.
+
+    :param directory: Directory to watch.
+    :param accept: Function called with a file path, returning True for files of interest.
+    :param recursive: Also watch subdirectories.
+    :param skip_dirs: Absolute directory paths that are never watched.
+    :param interval: Seconds between two stability checks (and scans when polling).
+    :param settle: Seconds a file has to stay unchanged.
+    """
+
+    # inotify(7) event flags
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self, directory, accept, recursive=False, skip_dirs=None, interval=1.0, settle=2.0):
+        self.directory = directory
+        self.accept = accept
+        self.recursive = recursive
+        self.skip_dirs = set(skip_dirs or [])
+        self.interval = interval
+        self.settle = settle
+        self.candidates = {}
+        self.snapshot = {}
+        self.watches = {}
+        self.fd = self.init_inotify()
+        self.method = "inotify" if self.fd is not None else "polling"
+
+        for path in self.scan():
+            self.add_candidate(path)
+        self.snapshot = {path: (size, mtime_ns) for path, (size, mtime_ns, _) in self.candidates.items()}
+
+    def init_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+
+        try:
+            import ctypes
+            import ctypes.util
+
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        except (OSError, AttributeError):
+            return None
+
+        if fd < 0:
+            return None
+
+        self.fd = fd
+        for path in [self.directory] + (self.list_directories(self.directory) if self.recursive else []):
+            if not self.add_watch(path):
+                os.close(fd)
+                return None
+        return fd
+
+    def list_directories(self, directory):
+        directories = []
+        for root, subdirectories, _ in os.walk(directory):
+            subdirectories[:] = [name for name in subdirectories if os.path.abspath(os.path.join(root, name)) not in self.skip_dirs]
+            directories.extend(os.path.join(root, name) for name in subdirectories)
+        return directories
+
+    def add_watch(self, path):
+        mask = self.IN_CREATE | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MODIFY
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            return False
+        self.watches[wd] = path
+        return True
+
+    def scan(self, directory=None):
+        directory = directory or self.directory
+        for path in iter_media_files(directory, recursive=self.recursive, skip_dirs=self.skip_dirs):
+            if self.accept(path):
+                yield path
+
+    def add_candidate(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.candidates.pop(path, None)
+            return
+        self.candidates[path] = (stat.st_size, stat.st_mtime_ns, time.time())
+
+    def read_events(self, timeout):
+        import select
+        import struct
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, fall back to one scan
+                for path in self.scan():
+                    self.add_candidate(path)
+                continue
+
+            if wd not in self.watches or not name:
+                continue
+            path = os.path.join(self.watches[wd], name)
+
+            if mask & self.IN_ISDIR:
+                if self.recursive and os.path.abspath(path) not in self.skip_dirs:
+                    # Files can land in a new directory before it is watched
+                    for directory in [path] + self.list_directories(path):
+                        self.add_watch(directory)
+                    for file in self.scan(path):
+                        self.add_candidate(file)
+            elif self.accept(path):
+                self.add_candidate(path)
+
+    def poll_scan(self, timeout):
+        time.sleep(timeout)
+        snapshot = {}
+        for path in self.scan():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+            if self.snapshot.get(path) != snapshot[path]:
+                self.add_candidate(path)
+        self.snapshot = snapshot
+
+    def poll(self):
+        """
+        Wait up to `interval` seconds for changes and return the files that became stable.
+        """
+
+        if self.fd is not None:
+            self.read_events(self.interval)
+        else:
+            self.poll_scan(self.interval)
+
+        now = time.time()
+        stable = []
+        for path, (size, mtime_ns, since) in list(self.candidates.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.candidates[path]
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - since >= self.settle and size > 0:
+                stable.append(path)
+                del self.candidates[path]
+        return stable
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def is_up_to_date(input_path, output_path, pos_args):
+    if not os.path.exists(output_path):
+        return False
+
+    if "--skip-existing" in pos_args:
+        return True
+
+    if "--if-newer" in pos_args:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+    return False
+
+def get_output_stat(output_path):
+    try:
+        stat = os.stat(output_path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+def remove_output(output_path, before):
+    # Outputs of failed or interrupted jobs are incomplete, without them is_up_to_date() lets the next run redo the job.
+    # `before` is get_output_stat() from before the job, a file the job never touched is kept.
+    try:
+        if os.path.isfile(output_path) and get_output_stat(output_path) != before:
+            os.remove(output_path)
+    except OSError:
+        pass
+
+def check_file(output_filename, output_path, pos_args, skip=False, display=None):
+    if output_filename and os.path.exists(output_path):
+        if '-y' not in pos_args:
+            ask = display.prompt if display else input
+            q = ask(f"File \"{output_filename}\" already exists. Overwrite? [y/N] ").lower()
+            if q and q != "y":
+                if not skip:
+                    sys.exit(0)
+                else:
+                    return True
+
+
+# Codecs each output container can hold without re-encoding, by stream type.
+# None allows every codec; containers not listed here are never stream-copied.
+CONTAINER_CODECS = {
+    ".mkv": {"video": None, "audio": None},
+    ".mka": {"audio": None},
+    ".mp4": {"video": {"h264", "hevc", "av1", "vp9", "mpeg4", "mpeg2video"}, "audio": {"aac", "mp3", "ac3", "eac3", "opus", "flac", "alac"}},
+    ".m4v": {"video": {"h264", "hevc", "av1", "mpeg4"}, "audio": {"aac", "ac3", "eac3", "alac"}},
+    ".mov": {"video": {"h264", "hevc", "mpeg4", "prores", "mjpeg", "dnxhd"}, "audio": {"aac", "mp3", "ac3", "eac3", "alac", "pcm_s16le", "pcm_s24le"}},
+    ".webm": {"video": {"vp8", "vp9", "av1"}, "audio": {"vorbis", "opus"}},
+    ".ts": {"video": {"h264", "hevc", "mpeg2video"}, "audio": {"aac", "mp3", "ac3", "eac3", "mp2"}},
+    ".m4a": {"audio": {"aac", "alac"}},
+    ".mp3": {"audio": {"mp3"}},
+    ".ogg": {"audio": {"vorbis", "opus", "flac"}},
+    ".opus": {"audio": {"opus"}},
+    ".flac": {"audio": {"flac"}},
+    ".wav": {"audio": {"pcm_s16le", "pcm_s24le", "pcm_s32le", "pcm_f32le", "pcm_u8"}},
+}
+
+# Codec produced by an encoder, for encoders not named after their codec
+ENCODER_CODECS = {
+    "libx264": "h264", "libx264rgb": "h264", "h264_nvenc": "h264", "h264_qsv": "h264", "h264_vaapi": "h264", "h264_videotoolbox": "h264",
+    "libx265": "hevc", "hevc_nvenc": "hevc", "hevc_qsv": "hevc", "hevc_vaapi": "hevc", "hevc_videotoolbox": "hevc",
+    "libvpx": "vp8", "libvpx-vp9": "vp9", "libaom-av1": "av1", "libsvtav1": "av1", "librav1e": "av1",
+    "libfdk_aac": "aac", "libmp3lame": "mp3", "libopus": "opus", "libvorbis": "vorbis",
+}
+
+CODEC_OPTIONS = ("-c", "-codec", "-vcodec", "-acodec")
+
+# Options that change the decoded frames or samples (or configure their encoder), so a stream
+# of that type has to be encoded. Cuts are included as well, since copied streams can only be
+# cut at keyframes.
+ENCODE_OPTIONS = {
+    "video": {
+        "-vf", "-filter:v", "-s", "-r", "-pix_fmt", "-aspect", "-crf", "-qp", "-b:v", "-q:v", "-qscale:v", "-maxrate", "-bufsize", "-g",
+        "-profile:v", "-level", "-vframes", "-frames:v", "-preset", "-tune", "-x264-params", "-x264opts", "-x265-params", "-svtav1-params",
+    },
+    "audio": {"-af", "-filter:a", "-ar", "-ac", "-b:a", "-q:a", "-qscale:a", "-aq", "-aframes", "-frames:a"},
+    "all": {"-filter_complex", "-lavfi", "-ss", "-sseof", "-t", "-to"},
+}
+
+# Output options that leave the encoded streams alone. Any other output option is taken as an
+# encoder setting of the stream types it applies to.
+MUXER_OPTIONS = {
+    "-map", "-map_metadata", "-map_chapters", "-metadata", "-disposition", "-f", "-movflags", "-tag", "-brand", "-shortest",
+    "-vn", "-an", "-sn", "-dn", "-y", "-n", "-nostdin", "-hide_banner", "-v", "-loglevel", "-stats", "-nostats", "-threads",
+    "-copyts", "-start_at_zero", "-avoid_negative_ts", "-fflags", "-max_muxing_queue_size", "-strict", "-bsf", "-write_tmcd",
+}
+
+def get_option_types(option):
+    """
+    Stream types ("video", "audio") an output option applies to.
+
+    The stream specifier decides (e.g. "-c:v:0", "-b:a" or "-c:s"). Options without a type
+    in it apply to both, unless they only exist for one type (e.g. "-crf" or "-ar").
+    """
+
+    base, _, specifier = option.partition(":")
+    if base == "-vcodec":
+        return {"video"}
+    if base == "-acodec":
+        return {"audio"}
+
+    kind = specifier[:1]
+    if kind in ("v", "V"):
+        return {"video"}
+    if kind == "a":
+        return {"audio"}
+    if kind in ("s", "d", "t"):
+        return set()
+
+    for codec_type in ("video", "audio"):
+        if option in ENCODE_OPTIONS[codec_type]:
+            return {codec_type}
+    return {"video", "audio"}
+
+def is_codec_option(option):
+    return option.partition(":")[0] in CODEC_OPTIONS
+
+def get_copy_plan(args, media_details):
+    """
+    Decide which stream types of a job can be copied instead of re-encoded.
+
+    A stream type is copied when every input stream of that type already has the
+    requested codec (or, without a codec option, one the output container can hold)
+    and no option of the job changes, cuts or configures the encoding of those streams.
+
+    :param args: ffmpeg arguments of the job with a single input, the output path last.
+    :param media_details: ffprobe data of the input (see get_media_details).
+    :return: A dict of stream type to True (copy) or False (encode), for the types present in the input.
+    """
+
+    if not media_details:
+        return {}
+
+    options = {arg for index, arg in enumerate(args[:-1]) if arg.startswith("-") and (index == 0 or args[index - 1] != "-i")}
+    container = CONTAINER_CODECS.get(os.path.splitext(args[-1])[1].lower(), {})
+
+    # Encoders named per stream type, and the types that got any other encoder setting
+    encoders = {"video": set(), "audio": set()}
+    settings = set()
+    output_start = max((index for index, arg in enumerate(args[:-1]) if arg == "-i"), default=-2) + 2
+    for index in range(output_start, len(args) - 1):
+        arg = args[index]
+        if not arg.startswith("-") or arg[1:2].isdigit():
+            continue
+        if is_codec_option(arg):
+            for codec_type in get_option_types(arg):
+                if index + 1 < len(args) - 1:
+                    encoders[codec_type].add(args[index + 1])
+        elif arg.partition(":")[0] not in MUXER_OPTIONS:
+            settings |= get_option_types(arg)
+
+    plan = {}
+    for codec_type in ("video", "audio"):
+        if f"-{codec_type[0]}n" in options:
+            continue
+
+        codecs = {
+            stream.get("codec_name") for stream in media_details.get("streams", [])
+            if stream.get("codec_type") == codec_type and not stream.get("disposition", {}).get("attached_pic")
+        }
+        if not codecs:
+            continue
+
+        named = encoders[codec_type]
+        if named == {"copy"}:
+            plan[codec_type] = True
+        elif codec_type in settings or options & (ENCODE_OPTIONS[codec_type] | ENCODE_OPTIONS["all"]):
+            plan[codec_type] = False
+        elif named:
+            plan[codec_type] = len(named) == 1 and codecs == {ENCODER_CODECS.get(encoder, encoder) for encoder in named}
+        else:
+            allowed = container.get(codec_type, set())
+            plan[codec_type] = codec_type in container and (allowed is None or codecs <= allowed)
+
+    return plan
+
+def apply_copy_plan(args, plan):
+    # Replace the codec options of copied stream types with '-c:<type> copy' in front of the output.
+    # A codec option also covering an encoded type stays, the later '-c:<type> copy' overrides it.
+    copied = [codec_type for codec_type, copy in plan.items() if copy]
+
+    new_args = []
+    skip = False
+    for arg in args[:-1]:
+        if skip:
+            skip = False
+        elif is_codec_option(arg) and get_option_types(arg) and get_option_types(arg) <= set(copied):
+            skip = True
+        else:
+            new_args.append(arg)
+
+    for codec_type in copied:
+        new_args += [f"-c:{codec_type[0]}", "copy"]
+    return new_args + args[-1:]
+
+def format_copy_plan(plan, file, pos_args):
+    mode = describe_copy_plan(plan)
+    details = ", ".join(f"{codec_type} {'copied' if copy else 'encoded'}" for codec_type, copy in plan.items())
+    text = f"[{mode}] {file}" + (f" ({details})" if details else "")
+
+    if "--stdout" in pos_args:
+        return text
+    color = "\33[92m" if mode == "remux" else "\33[93m"
+    return f"{color}{text}\33[0m"
+
+def describe_copy_plan(plan):
+    copied = [codec_type for codec_type, copy in plan.items() if copy]
+    if plan and len(copied) == len(plan):
+        return "remux"
+    if copied:
+        return "partial"
+    return "transcode"
+
+class ProgressParser:
+    """
+    Parser for the key=value blocks written by `ffmpeg -progress`.
+
+    Every block ends with a `progress=continue` or `progress=end` line.
+    """
+
+    def __init__(self):
+        self.block = {}
+
+    def feed(self, line):
+        """
+        Feed one line of progress output.
+
+        :param line: A single `key=value` line.
+        :return: The completed block as a dict once its `progress` line is read, otherwise None.
+        """
+
+        key, sep, value = line.partition("=")
+        if not sep:
+            return None
+
+        self.block[key.strip()] = value.strip()
+
+        if key == "progress":
+            block, self.block = self.block, {}
+            return block
+
+def get_duration(file_path):
+    import subprocess
+
+    # Read the container duration (in seconds) with a minimal ffprobe query
+    command = [
+        'ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path
+    ]
+
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0:
+            return float(result.stdout.strip())
+    except Exception:
+        pass
+
+def format_speed(speed, pos_args):
+    if "--stdout" in pos_args:
+        return f"speed={speed}"
+    elif "--colored" in pos_args:
+        colors = [(240, 120, 255), (255, 250, 100)]  # Pink -> Yellow
+        return f'{gradient_text(f"speed:{speed}", colors)}'
+    else:
+        return f"\33[92mspeed:{speed}\33[0m"
+
+def handle_progress(state, block, pos_args, input_file, prefix):
+    state.stats = block
+
+    try:
+        iteration = int(block["out_time_us"]) / 1_000_000
+    except (KeyError, ValueError):
+        return
+
+    total = state.total_duration
+    if not total or iteration < 0:
+        return
+
+    speed = block.get("speed", "N/A")
+
+    if state.error:
+        if '--log' in pos_args:
+            state.log("\n".join(state.stdline))
+        else:
+            for index, path in enumerate(input_file):
+                inputs = []
+                if "--stdout" in pos_args:
+                    inputs.append(f"input{index}:\"{path}\"")
+                else:
+                    state.log(f"Input #{index}: from \"{path}\"")
+
+            # if "--stdout" in pos_args:
+            #     print(json.dumps({
+            #         "input": inputs
+            #     }))
+
+    suffix = format_speed(speed, pos_args)
+
+    state.suffix = suffix
+    state.error = False
+
+    # The final block can overshoot the probed duration by a few milliseconds
+    if block.get("progress") == "end":
+        iteration = total
+
+    if state.on_progress:
+        state.on_progress(state, min(iteration, total), block)
+        return
+
+    state.progress = print_progress_bar(state, state.start_time, min(iteration, total), total, pos_args, prefix=prefix, suffix=suffix)
+
+def handle_line(state, text, pos_args, input_file, prefix, progress_pipe=False):
+    if progress_pipe:
+        block = state.parser.feed(text)
+        if block and state.progress != "OK":
+            handle_progress(state, block, pos_args, input_file, prefix)
+        return
+
+    state.add_line(text)
+
+    if "Duration" in text and not state.total_duration:
+        # Fall back to the log banner for inputs ffprobe cannot read on its own
+        try:
+            state.total_duration = duration_to_seconds(text.split()[1].strip(","))
+        except Exception:
+            pass
+
+def read_pipe(state, process, pipe, pos_args, input_file, prefix, progress_pipe=False):
+    while True:
+        line = pipe.readline()
+        if not line:
+            break
+        handle_line(state, line.strip(), pos_args, input_file, prefix, progress_pipe)
+
+    # Close the pipe after reading
+    pipe.close()
+
+class PipeReader:
+    """
+    A single thread reading the output pipes of all running ffmpeg processes.
+
+    Pipes are non-blocking and watched with `selectors` (epoll on Linux), so the number
+    of threads does not grow with the number of jobs. Output is split into lines on both
+    line feeds and carriage returns, and every line is passed to the callback of its pipe.
+
+    Only available where pipes can be selected (not on Windows), see get_pipe_reader().
+    """
+
+    def __init__(self):
+        import selectors
+
+        self.selector = selectors.DefaultSelector()
+        self.pending = deque()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.run, name="ffmpegp-pipe-reader", daemon=True)
+        self.thread.start()
+
+    def add(self, pipe, on_line, on_close):
+        """
+        Read `pipe` until EOF, calling `on_line(text)` per line and `on_close()` at the end.
+        """
+
+        os.set_blocking(pipe.fileno(), False)
+        # The selector is only touched by the reader thread, it picks new pipes up when woken
+        self.pending.append((pipe, on_line, on_close))
+        os.write(self.wakeup_write, b"\0")
+
+    def run(self):
+        import selectors
+        import traceback
+
+        buffers = {}
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj == self.wakeup_read:
+                    try:
+                        os.read(self.wakeup_read, 4096)
+                    except BlockingIOError:
+                        pass
+                    while self.pending:
+                        pipe, on_line, on_close = self.pending.popleft()
+                        buffers[pipe.fileno()] = b""
+                        self.selector.register(pipe.fileno(), selectors.EVENT_READ, (pipe, on_line, on_close))
+                    continue
+
+                fd = key.fileobj
+                pipe, on_line, on_close = key.data
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+
+                lines = re.split(rb"[\r\n]", buffers[fd] + data)
+                # Keep an unfinished line for the next read, flush it at EOF
+                buffers[fd] = lines.pop() if data else b""
+                if not data and lines[-1:] == [b""]:
+                    lines.pop()
+
+                try:
+                    for line in lines:
+                        text = line.decode("utf-8", "replace").strip()
+                        if text:
+                            on_line(text)
+                except Exception:
+                    # A failing callback must not stop the output of the other jobs
+                    traceback.print_exc()
+
+                if not data:
+                    self.selector.unregister(fd)
+                    del buffers[fd]
+                    pipe.close()
+                    on_close()
+
+pipe_reader = None
+pipe_reader_lock = threading.Lock()
+
+def get_pipe_reader():
+    # The shared PipeReader, started on first use; None where pipes cannot be selected
+    global pipe_reader
+
+    if os.name != "posix":
+        return None
+
+    with pipe_reader_lock:
+        if pipe_reader is None:
+            pipe_reader = PipeReader()
+    return pipe_reader
+
+def kill_processes(processes, timeout=5):
+    """
+    Stop ffmpeg processes together with anything they spawned.
+
+    ffmpeg runs in its own process group (on POSIX), so Ctrl+C does not reach it. It first
+    gets SIGTERM, which lets it finalize its outputs and restore the terminal settings,
+    and is killed if it is still running after `timeout` seconds (or on a second Ctrl+C).
+    """
+
+    import signal
+
+    def send(process, force):
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+            elif force:
+                process.kill()
+            else:
+                process.terminate()
+        except Exception:
+            pass
+
+    running = [process for process in processes if process.poll() is None]
+    for process in running:
+        send(process, False)
+
+    deadline = time.time() + timeout
+    try:
+        while time.time() < deadline and any(process.poll() is None for process in running):
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        pass
+
+    for process in running:
+        if process.poll() is None:
+            send(process, True)
+
+def kill_jobs(states, timeout=5):
+    # Stop every ffmpeg of the jobs at once, the earlier stages of '--then' pipelines included
+    kill_processes([process for state in states for process in [*state.stages, state.process] if process], timeout)
+
+def wait_process(process):
+    """
+    Wait for a process to exit and return its peak resident set size in bytes.
+
+    The child is reaped with os.wait4 to get its resource usage, so this only works for
+    processes that nothing else waits for. Returns None where os.wait4 is not available.
+    """
+
+    if not hasattr(os, "wait4"):
+        process.wait()
+        return None
+
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Already reaped by Popen.poll(), e.g. from kill_processes()
+        process.wait()
+        return None
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+def summarize_job(state, args, input_file):
+    """
+    Build the machine-readable summary of a finished job.
+
+    :param state: JobState of the finished job.
+    :param args: ffmpeg arguments of the job, the output path last.
+    :param input_file: List of input paths of the job.
+    """
+
+    block = state.stats or {}
+    wall_time = (state.end_time or time.time()) - state.start_time
+
+    try:
+        media_time = max(0, int(block["out_time_us"])) / 1_000_000
+    except (KeyError, ValueError):
+        media_time = None
+
+    try:
+        frames = int(block["frame"])
+    except (KeyError, ValueError):
+        frames = None
+
+    def size(path):
+        try:
+            return os.path.getsize(path)
+        except (OSError, TypeError):
+            return None
+
+    input_sizes = [size(path) for path in input_file]
+    outputs = state.outputs or args[-1:]
+    output_sizes = [size(path) for path in outputs]
+    return {
+        "input": input_file[0] if len(input_file) == 1 else list(input_file),
+        "output": outputs[0] if len(outputs) == 1 else list(outputs) if outputs else None,
+        "exit_code": state.returncode,
+        "started": round(state.start_time, 3),
+        "wall_time": round(wall_time, 3),
+        "media_time": media_time,
+        "speed": round(media_time / wall_time, 3) if media_time is not None and wall_time > 0 else None,
+        "frames": frames,
+        "avg_fps": round(frames / wall_time, 2) if frames is not None and wall_time > 0 else None,
+        "input_bytes": sum(input_sizes) if input_sizes and None not in input_sizes else None,
+        "output_bytes": sum(output_sizes) if output_sizes and None not in output_sizes else None,
+        "peak_rss_bytes": state.peak_rss,
+    }
+
+class Metrics:
+    """
+    Collects job summaries of a run.
+
+    Every summary is appended to `summary_path` as one JSON line when the job ends.
+    Totals of the run are written to `metrics_path` in the Prometheus text format,
+    for the textfile collector of node_exporter.
+
+    :param summary_path: Optional JSON lines file receiving one summary per job.
+    :param metrics_path: Optional Prometheus textfile (e.g. /var/lib/node_exporter/ffmpegp.prom).
+    """
+
+    def __init__(self, summary_path=None, metrics_path=None):
+        self.summary_path = summary_path
+        self.metrics_path = metrics_path
+        self.start_time = time.time()
+        self.summaries = []
+        self.lock = threading.Lock()
+
+    def record(self, summary):
+        import json
+
+        with self.lock:
+            self.summaries.append(summary)
+            if self.summary_path:
+                with open(self.summary_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(summary) + "\n")
+
+    def totals(self):
+        with self.lock:
+            summaries = list(self.summaries)
+
+        def total(field):
+            return sum(summary[field] or 0 for summary in summaries)
+
+        wall_time = time.time() - self.start_time
+        return {
+            "jobs_ok": sum(1 for summary in summaries if summary["exit_code"] == 0),
+            "jobs_failed": sum(1 for summary in summaries if summary["exit_code"] != 0),
+            "wall_time": wall_time,
+            "job_time": total("wall_time"),
+            "media_time": total("media_time"),
+            "frames": total("frames"),
+            "input_bytes": total("input_bytes"),
+            "output_bytes": total("output_bytes"),
+            "peak_rss_bytes": max((summary["peak_rss_bytes"] or 0 for summary in summaries), default=0),
+        }
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+
+        totals = self.totals()
+        metrics = [
+            ("ffmpegp_batch_jobs", "Finished ffmpeg jobs of the last run by result.", [('{result="ok"}', totals["jobs_ok"]), ('{result="failed"}', totals["jobs_failed"])]),
+            ("ffmpegp_batch_duration_seconds", "Wall time of the last run.", [("", totals["wall_time"])]),
+            ("ffmpegp_batch_job_seconds", "Summed wall time of the jobs of the last run.", [("", totals["job_time"])]),
+            ("ffmpegp_batch_media_seconds", "Media time encoded in the last run.", [("", totals["media_time"])]),
+            ("ffmpegp_batch_realtime_factor", "Media seconds encoded per wall clock second in the last run.", [("", totals["media_time"] / totals["wall_time"] if totals["wall_time"] > 0 else 0)]),
+            ("ffmpegp_batch_frames", "Frames encoded in the last run.", [("", totals["frames"])]),
+            ("ffmpegp_batch_input_bytes", "Input bytes read in the last run.", [("", totals["input_bytes"])]),
+            ("ffmpegp_batch_output_bytes", "Output bytes written in the last run.", [("", totals["output_bytes"])]),
+            ("ffmpegp_batch_peak_rss_bytes", "Highest peak resident set size of a single ffmpeg process in the last run.", [("", totals["peak_rss_bytes"])]),
+            ("ffmpegp_batch_end_timestamp_seconds", "Unix time the last run ended.", [("", time.time())]),
+        ]
+
+        lines = []
+        for name, help_text, samples in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {round(value, 6)}")
+
+        # The collector may read at any time, so the file is replaced atomically
+        temp_path = f"{self.metrics_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.metrics_path)
+
+def get_pipeline_args(args):
+    """
+    Split the arguments of a job into the stages of a '--then' pipeline.
+
+    Every stage but the first reads NUT from stdin, every stage but the last writes NUT
+    to stdout. Unless a stage sets its codecs, the streams in between are raw video and
+    float PCM, so nothing is lost and no time is spent encoding them.
+
+    :param args: ffmpeg arguments with the stages separated by "--then", the output path last.
+    :return: A list with the ffmpeg arguments of every stage (a single one without "--then").
+    """
+
+    stages = [[]]
+    for arg in args:
+        if arg == "--then":
+            stages.append([])
+        else:
+            stages[-1].append(arg)
+
+    for index, stage in enumerate(stages):
+        if index > 0:
+            # The previous stage is input #0, so stage inputs like a watermark follow it
+            stage[:0] = ["-f", "nut", "-i", "pipe:0"]
+
+        if index < len(stages) - 1:
+            named = {codec_type for arg in stage if is_codec_option(arg) for codec_type in get_option_types(arg)}
+            if "video" not in named:
+                stage += ["-c:v", "rawvideo"]
+            if "audio" not in named:
+                stage += ["-c:a", "pcm_f32le"]
+            stage += ["-f", "nut", "pipe:1"]
+
+    return stages
+
+def start_process(args, pos_args, input_file, prefix='', pid=None, state=None):
+    import subprocess
+
+    if state is None:
+        state = JobState()
+
+    processes = []
+
+    try:
+        if input_file and not state.total_duration:
+            state.total_duration = get_duration(input_file[0])
+
+        stages = get_pipeline_args(args)
+        commands = []
+        for index, stage_args in enumerate(stages):
+            # Machine-readable progress is written to stdout, the log stays on stderr.
+            # Earlier pipeline stages write the media to stdout, the last stage reports for all.
+            progress_args = ["-progress", "pipe:1"] if index == len(stages) - 1 else []
+            command = [*state.command_prefix, "ffmpeg", *progress_args, "-nostats", *stage_args]
+            if input_filenames:
+                command.append("-y")
+            commands.append(command)
+
+        if state.host:
+            # The open stdin keeps the remote ffmpeg alive, see get_remote_command()
+            commands[-1] = get_remote_command(state.ssh_command, state.host, commands[-1], cwd=state.remote_cwd)
+
+        reader = get_pipe_reader()
+
+        # ffmpeg is executed directly (no shell) in its own process group, see kill_processes()
+        # The shared reader decodes the raw pipes itself, the thread fallback reads text
+        for command in commands:
+            if processes:
+                stdin = processes[-1].stdout
+            else:
+                stdin = subprocess.PIPE if state.host else subprocess.DEVNULL if state.batch else None
+
+            process = subprocess.Popen(
+                command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, stdin=stdin,
+                text=reader is None, encoding='utf-8' if reader is None else None, start_new_session=os.name == "posix"
+            )
+            if processes:
+                # Only the next stage reads from the pipe
+                processes[-1].stdout.close()
+            processes.append(process)
+
+        state.process = process
+        state.stages = processes[:-1]
+        state.start_time = time.time()
+
+        # The log of every stage, and the progress of the last one
+        pipes = [(stage.stderr, False) for stage in processes] + [(process.stdout, True)]
+
+        if reader:
+            closed = threading.Semaphore(0)
+            for pipe, progress_pipe in pipes:
+                reader.add(pipe, lambda text, progress_pipe=progress_pipe: handle_line(state, text, pos_args, input_file, prefix, progress_pipe), closed.release)
+
+            # Wait until all pipes reached EOF
+            for _ in pipes:
+                closed.acquire()
+        else:
+            # Threads to read stdout and stderr
+            threads = [threading.Thread(target=read_pipe, args=(state, process, pipe, pos_args, input_file, prefix, progress_pipe)) for pipe, progress_pipe in pipes]
+
+            # Start the threads
+            for thread in threads:
+                thread.start()
+
+            # Wait for all threads to complete
+            for thread in threads:
+                thread.join()
+
+        # Wait for the processes to complete; the stages of a pipeline run at the same time
+        peak_rss = [wait_process(stage) for stage in processes]
+        state.peak_rss = sum(peak_rss) if None not in peak_rss else None
+        # A failing stage fails the job, even when the later stages finished on its truncated output
+        returncode = next((stage.returncode for stage in processes if stage.returncode), 0)
+        state.returncode = returncode
+        if returncode and state.stages:
+            state.error = True
+        if state.host:
+            # Only the local ssh client was measured
+            state.peak_rss = None
+            process.stdin.close()
+        state.end_time = time.time()
+
+        if returncode == 0 and not state.error and state.progress != "OK":
+            print_progress_bar(state, state.start_time, state.total_duration, state.total_duration, pos_args, prefix=prefix, suffix=state.suffix)
+
+        if state.error:
+            output = "\n".join(state.stdline)
+            state.finish(output.replace("usage: ffmpeg", f"usage: ffmpegp").strip())
+        else:
+            state.finish()
+
+        if state.metrics:
+            state.metrics.record(summarize_job(state, args, input_file))
+
+        return returncode
+
+    except (EOFError, KeyboardInterrupt):
+        kill_processes(processes)
+        print("\nProgram interrupted!")
+        sys.exit(1)
+
+def get_keyframe_cuts(file_path, duration, parts, window=10, start_time=0):
+    """
+    Pick keyframe timestamps that split a file into `parts` segments of similar length.
+
+    Only the packets within `window` seconds after every target position are read,
+    so long inputs are not scanned completely.
 
-if not ffmpeg_path:
-    print(f"'\33[92mffmpeg\33[0m' \33[91mis not installed. Cannot continue.\33[0m")
-    sys.exit(-1)
+    :param file_path: Input file.
+    :param duration: Input duration in seconds.
+    :param parts: Number of segments.
+    :param start_time: The input's format start_time. Packet timestamps include it, input `-ss` positions do not.
+    :return: A list of cut positions in seconds (relative to the start, without 0 and the end), ascending.
+    """
 
-if ffmpeg_path and not ffprobe_path:
-    print(f"'\33[92mffprobe\33[0m' \33[91mis missing. Cannot continue.\33[0m")
-    sys.exit(-1)
+    import subprocess
 
-def get_media_details(file_path):
-    # Use ffprobe (a tool bundled with ffmpeg) to extract media details
+    targets = [duration * index / parts for index in range(1, parts)]
+    intervals = ",".join(f"{start_time + target:.3f}%+{window}" for target in targets)
     command = [
-        'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', intervals,
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', file_path
     ]
-    
+
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                keyframes.append(float(pts_time) - start_time)
+            except ValueError:
+                continue
+    keyframes.sort()
+
+    if not keyframes:
+        # Audio-only inputs can be cut anywhere
+        return targets
+
+    cuts = []
+    for target in targets:
+        after = [keyframe for keyframe in keyframes if keyframe >= target]
+        cut = after[0] if after else keyframes[-1]
+        if 0 < cut < duration and (not cuts or cut > cuts[-1]):
+            cuts.append(cut)
+    return cuts
+
+class SplitProgress:
+    """
+    Rolls the progress of concurrently encoded segments up into a single progress bar.
+
+    It is the display of the segment jobs, so their own bars and error logs are collected here.
+
+    :param total: Duration of the whole input in seconds.
+    :param pos_args: Positional flags of the current invocation.
+    :param prefix: Progress bar prefix.
+    """
+
+    def __init__(self, total, pos_args, prefix=''):
+        self.state = JobState()
+        self.state.start_time = time.time()
+        self.state.total_duration = total
+        self.pos_args = pos_args
+        self.prefix = prefix
+        self.done = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def progress(self, state, seconds, block):
+        with self.lock:
+            self.done[state.key] = seconds
+            iteration = min(sum(self.done.values()), self.state.total_duration)
+
+            # Combined speed: encoded media seconds per wall clock second
+            elapsed = time.time() - self.state.start_time
+            speed = f"{iteration / elapsed:.3g}x" if elapsed > 0 else "N/A"
+            self.state.suffix = format_speed(speed, self.pos_args)
+
+            if iteration < self.state.total_duration:
+                print_progress_bar(self.state, self.state.start_time, iteration, self.state.total_duration, self.pos_args, prefix=self.prefix, suffix=self.state.suffix)
+
+    def complete(self):
+        total = self.state.total_duration
+        print_progress_bar(self.state, self.state.start_time, total, total, self.pos_args, prefix=self.prefix, suffix=self.state.suffix)
+        print()
+
+    def update(self, key, text):
+        pass
+
+    def log(self, text):
+        pass
+
+    def finish(self, key, text=None):
+        if text:
+            with self.lock:
+                self.errors.append(text)
+
+def split_process(args, pos_args, input_file, parts, log_lines=LOG_LINES, log_file=None, command_prefix=None, metrics=None):
+    """
+    Encode one input as `parts` segments in parallel and join them with the concat demuxer.
+
+    Segments are cut at keyframes, so each one starts with a complete picture and the
+    encoded segments can be joined with `-c copy`.
+
+    :param args: ffmpeg arguments of the whole job, the output path last.
+    :param pos_args: Positional flags of the current invocation.
+    :param input_file: A list with the single input path.
+    :param parts: Number of segments.
+    :param command_prefix: Optional command put in front of every ffmpeg call (see get_priority_command).
+    :param metrics: Optional Metrics receiving one summary of the whole job.
+    """
+
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    media_details = get_media_details(input_file[0], use_cache="--no-cache" not in pos_args)
     try:
-        # Run the command
+        duration = float(media_details["format"]["duration"])
+    except (TypeError, KeyError, ValueError):
+        duration = None
+
+    try:
+        start_time = float(media_details["format"].get("start_time", 0))
+    except (TypeError, KeyError, ValueError):
+        start_time = 0
+
+    cuts = get_keyframe_cuts(input_file[0], duration, parts, start_time=start_time) if duration else []
+    if not cuts:
+        # Too short or not seekable, encode it in one piece
+        state = JobState(log_lines=log_lines, log_file=log_file)
+        state.command_prefix = command_prefix or []
+        state.metrics = metrics
+        return start_process(args=args, pos_args=pos_args, input_file=input_file, state=state)
+
+    output_path = args[-1]
+    output_directory, output_name = os.path.split(os.path.abspath(output_path))
+    name, extension = os.path.splitext(output_name)
+    bounds = list(zip([0.0] + cuts, cuts + [None]))
+    segments = [os.path.join(output_directory, f".{name}.part{index:03}{extension}") for index in range(len(bounds))]
+    list_path = os.path.join(output_directory, f".{name}.parts.txt")
+
+    split_progress = SplitProgress(duration, pos_args)
+    states = []
+
+    for index, path in enumerate(input_file):
+        split_progress.state.log(f"Input #{index}: from \"{path}\" ({len(bounds)} segments)")
+
+    def record(returncode):
+        # One summary for the whole job, rolled up from the segments
+        if not metrics:
+            return
+
+        def total(field):
+            try:
+                return str(sum(max(0, int(state.stats[field])) for state in states))
+            except (KeyError, ValueError):
+                return None
+
+        job = split_progress.state
+        job.end_time = time.time()
+        job.returncode = returncode
+        job.stats = {field: total(field) for field in ("out_time_us", "frame") if total(field) is not None}
+        # The segments run at the same time
+        peak_rss = [state.peak_rss for state in states]
+        job.peak_rss = sum(peak_rss) if None not in peak_rss else None
+        metrics.record(summarize_job(job, args, input_file))
+
+    def encode(index):
+        start, end = bounds[index]
+        segment_args = list(args)
+        position = segment_args.index("-i")
+        segment_args[position:position] = ["-ss", f"{start:.6f}"]
+        segment_args[-1] = segments[index]
+        if end is not None:
+            segment_args[-1:-1] = ["-t", f"{end - start:.6f}"]
+
+        state = JobState(display=split_progress, key=index, log_lines=log_lines, log_file=log_file, log_prefix=f"part{index:03} ")
+        state.total_duration = (end or duration) - start
+        state.on_progress = split_progress.progress
+        state.command_prefix = command_prefix or []
+        state.batch = True
+        states.append(state)
+        return start_process(args=segment_args, pos_args=pos_args, input_file=[], state=state)
+
+    executor = ThreadPoolExecutor(max_workers=len(bounds))
+    try:
+        returncodes = list(executor.map(encode, range(len(bounds))))
+        executor.shutdown()
+
+        if any(returncodes):
+            print()
+            for text in split_progress.errors:
+                print(text.replace("usage: ffmpeg", "usage: ffmpegp"))
+            record(max(returncodes))
+            return max(returncodes)
+
+        # Join the segments without re-encoding
+        with open(list_path, "w", encoding="utf-8") as file:
+            for path in segments:
+                escaped = path.replace("'", "'\\''")
+                file.write(f"file '{escaped}'\n")
+
+        command = [*(command_prefix or []), "ffmpeg", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-map", "0", "-c", "copy", "-y", output_path]
         result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
         if result.returncode != 0:
-            print(f"Error occurred: {result.stderr}")
-            return None
+            print()
+            print(result.stderr.strip())
+            record(result.returncode)
+            return result.returncode
 
-        # Parse the JSON result
-        media_info = json.loads(result.stdout)
-        return media_info
-    
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+        split_progress.complete()
+        record(0)
+        return 0
 
-def query_json(json_data, json_path):
+    except (EOFError, KeyboardInterrupt):
+        executor.shutdown(wait=False, cancel_futures=True)
+        kill_jobs(states)
+        print("\nProgram interrupted!")
+        sys.exit(1)
+
+    finally:
+        for path in segments + [list_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def read_cpu_times():
+    # Busy and total jiffies of all CPUs from the first line of /proc/stat
     try:
-        # Parse and apply the JSON path query
-        jsonpath_expr = parse(json_path)
-        result = [match.value for match in jsonpath_expr.find(json_data)]
-        return result if result else None
-    except Exception as e:
-        print(f"Invalid JSON path or error: {e}")
+        with open("/proc/stat") as file:
+            values = [int(value) for value in file.readline().split()[1:]]
+    except (OSError, ValueError):
         return None
 
-def extract_output(path) -> str:
-    output_filename, output_extension = os.path.splitext(path)
-    output_directory, output_template = os.path.split(output_filename)
-    return output_directory, output_filename, output_template, output_extension
+    idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+    return sum(values) - idle, sum(values)
 
-def gradient_text(word, colors):
+def read_available_memory():
+    # MemAvailable from /proc/meminfo in bytes, None where it is not provided
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class LoadScheduler:
     """
-    Apply multiple gradients to the given text.
+    Admission control for batch jobs based on the live CPU usage and available memory.
 
-    :param word: The word to apply the gradient to.
-    :param colors: A list of tuples, each representing an RGB color for the gradients.
-    :return: A string with the text colored according to the gradients.
+    CPU usage is measured from /proc/stat between two checks, so a job that was just
+    started shows up within `interval` seconds, unlike in the one minute load average
+    which is only used where /proc/stat is missing. New jobs wait `settle` seconds after
+    the previous one, giving ffmpeg time to spin up its threads before the next decision.
+
+    :param max_load: Highest CPU usage (0-1, share of all cores) at which another job may start.
+    :param min_memory: Bytes of available memory that have to remain to start another job.
+    :param interval: Seconds between two checks while jobs wait for admission.
+    :param settle: Seconds after a job start before the next job may be admitted.
     """
 
-    if len(word) < 2 or len(colors) < 2:
-        color = list(map(str, colors[0]))
-        return f'\033[38;2;{";".join(color)}m{word}\033[0m'
+    def __init__(self, max_load=0.85, min_memory=512 * 1024 * 1024, interval=1.0, settle=2.0):
+        self.max_load = max_load
+        self.min_memory = min_memory
+        self.interval = interval
+        self.settle = settle
+        self.last_start = 0
+        self.last_times = read_cpu_times()
+
+    def cpu_load(self):
+        times = read_cpu_times()
+        if times and self.last_times and times[1] > self.last_times[1]:
+            busy = times[0] - self.last_times[0]
+            total = times[1] - self.last_times[1]
+            self.last_times = times
+            return busy / total
 
-    gradient_str = ""
-    num_segments = len(colors) - 1
-    segment_length = len(word) // num_segments
-    remainder = len(word) % num_segments
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            # No load information on this platform, rely on the job limit alone
+            return 0.0
 
-    # Generate the gradient for each segment
-    for segment_index in range(num_segments):
-        start_color = colors[segment_index]
-        end_color = colors[segment_index + 1]
-        segment_size = segment_length + (1 if segment_index < remainder else 0)
+    def admit(self):
+        if time.time() - self.last_start < self.settle:
+            return False
 
-        if segment_size > 1:
-            step = [(end_color[i] - start_color[i]) / (segment_size - 1) for i in range(3)]
-        else:
-            step = [0, 0, 0]  # No transition needed if only one character in this segment
+        if self.cpu_load() > self.max_load:
+            return False
 
-        for i in range(segment_size):
-            char_index = segment_index * segment_length + min(segment_index, remainder) + i
-            r = int(start_color[0] + step[0] * i)
-            g = int(start_color[1] + step[1] * i)
-            b = int(start_color[2] + step[2] * i)
-            gradient_str += f'\033[38;2;{r};{g};{b}m{word[char_index]}\033[0m'
-    
-    return gradient_str
+        memory = read_available_memory()
+        return memory is None or memory >= self.min_memory
 
-def duration_to_seconds(duration):
-    h, m, s = map(float, duration.split(':'))
-    return h * 3600 + m * 60 + s
+    def started(self):
+        self.last_start = time.time()
 
-def extract_time(log_line):
-    # Define the regular expression pattern to extract the time
-    time_pattern = r"time=(\d{2}:\d{2}:\d{2}\.\d{2})"
-    
-    # Search for the pattern in the log line
-    match = re.search(time_pattern, log_line)
-    
-    # If a match is found, return the extracted time
-    if match:
-        return match.group(1)
-    else:
-        return "N/A"
+def get_job_cost(media_details):
+    # Rough encoding cost of a file: duration times the pixels of its largest video stream
+    if not media_details:
+        return 0.0
 
-def get_readable_file_size(file_path):
-    size_bytes = os.path.getsize(file_path)
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024
+    try:
+        duration = float(media_details.get("format", {}).get("duration") or 0)
+    except ValueError:
+        duration = 0.0
 
-def print_progress_bar(start_time, iteration, total, pos_args, prefix='', suffix='', done='Complete', decimals=1, length=30, fill='━'):
-    global prev_bar_fill_length
+    pixels = max((stream.get("width", 0) * stream.get("height", 0) for stream in media_details.get("streams", []) if stream.get("codec_type") == "video"), default=0)
+    return duration * max(pixels, 1)
 
-    if suffix:
-        suffix = f"| {suffix} |"
-    else:
-        suffix = "|"
+def order_files(paths, order, max_jobs, use_cache=True):
+    """
+    Sort files by their estimated encoding cost, probing them concurrently.
 
-    if done:
-        if "--colored" in pos_args:
-            colors = [(255, 255, 100), (100, 200, 255)] # Yellow -> Cyan
-            done = f"| {gradient_text(done, colors)} |"
-        else:
-            done = f"| \33[92m{done}\33[0m |"
-    else:
-        done = "|"
+    Starting the longest jobs first keeps a short job, not a long one, at the end of a
+    parallel batch, which cuts the time the batch spends on a single remaining job.
 
-    color = "\33[93m"
-    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-    filled_length = int(length * iteration // total)
+    :param paths: A list of file paths.
+    :param order: "longest" (most expensive first) or "shortest".
+    :param max_jobs: Maximum number of concurrent ffprobe processes.
+    :param use_cache: Use the on-disk metadata cache.
+    """
 
-    # Capture end time
-    end_time = time.time()
+    from concurrent.futures import ThreadPoolExecutor
 
-    # Calculate elapsed time
-    elapsed_time = end_time - start_time
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        costs = dict(zip(paths, executor.map(lambda path: get_job_cost(get_media_details(path, use_cache=use_cache, verbose=False)), paths)))
 
-    # Format the difference as HH:MM:SS
-    formatted_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
+    return sorted(paths, key=costs.get, reverse=order == "longest")
 
-    if "--colored" in pos_args:
-        colors = [(100, 200, 255), (255, 255, 100)]  # Cyan -> Yellow
-        formatted_time = gradient_text(formatted_time, colors)
-        colors = [(100, 200, 255), (255, 100, 255), (255, 255, 100)]  # Cyan -> Pink -> Yellow
-        bar = f"{gradient_text(fill * filled_length, colors)}" + f'\33[90m{fill}\33[0m' * (length - filled_length)
-    else:
-        if float(percent) >= 30:
-            color = "\33[92m"
-        formatted_time = f"\33[96m{formatted_time}\33[0m"
-        bar = f"{color}{fill * filled_length}" + f'\33[90m{fill}\33[0m' * (length - filled_length)
+def get_priority_command(nice=None, ionice=None):
+    """
+    Build the command that runs ffmpeg with a lower CPU and I/O priority.
 
-    if "--stdout" in pos_args:
-        bar_fill = re.sub(r'\x1B\[[^m]*m', '', f"{prefix}progress={percent}% {suffix.replace("|", "").strip()} time={formatted_time}")
-    else:
-        bar_fill = f"{prefix}{bar} {percent}% {suffix} {formatted_time}"
+    :param nice: Niceness increment for `nice -n` (e.g. "10").
+    :param ionice: I/O scheduling class for `ionice`, as "idle", "best-effort[:level]" or "realtime[:level]".
+    """
 
-    bar_fill_length = len(re.sub(r'\x1B\[[^m]*m', '', bar_fill))
-        
-    if prev_bar_fill_length is not None and bar_fill_length != prev_bar_fill_length:
-        sys.stdout.write("\r" + " " * prev_bar_fill_length)
-    prev_bar_fill_length = bar_fill_length
+    import shutil
 
-    sys.stdout.write(f'\r' + bar_fill)
+    command = []
+    if os.name != "posix":
+        if nice or ionice:
+            print("'--nice' and '--ionice' are only supported on POSIX systems, running with normal priority.")
+        return command
 
-    # Print New Line on Complete
-    if iteration == total or int(round(float(percent), 0)) == 100:
-        if "--colored" in pos_args:
-            bar = gradient_text(fill * length, colors)
+    if nice:
+        try:
+            command += ["nice", "-n", str(int(nice))]
+        except ValueError:
+            print(f"provided '--nice' value '{nice}' is not a number.")
+            sys.exit(1)
+
+    if ionice:
+        if not shutil.which("ionice"):
+            print("'\33[92mionice\33[0m' is not installed, running with normal I/O priority.")
         else:
-            bar = f"{color}{fill}\33[0m" * length
+            io_class, _, level = ionice.partition(":")
+            classes = {"realtime": "1", "best-effort": "2", "idle": "3"}
+            command += ["ionice", "-c", classes.get(io_class, io_class)]
+            if level:
+                command += ["-n", level]
 
-        if "--stdout" in pos_args:
-            bar_fill = re.sub(r'\x1B\[[^m]*m', '', f"{prefix}progress=100% {suffix.replace("|", "").strip()} time={formatted_time}")
-        else:
-            bar_fill = f"{prefix}{bar} 100% {done} {formatted_time}"
-            
-        sys.stdout.write("\r" + " " * bar_fill_length)
-        sys.stdout.write(f"\r" + bar_fill)
-        return "OK"
+    return command
 
-def check_file(output_filename, output_path, pos_args, skip=False):
-    if output_filename and os.path.exists(output_path):
-        if '-y' not in pos_args:
-            output_filename = output_filename.replace("\"", "")
-            q = input(f"File \"{output_filename}\" already exists. Overwrite? [y/N] ").lower()
-            if q and q != "y":
-                if not skip:
-                    sys.exit(0)
+def get_remote_command(ssh_command, host, command, cwd=None):
+    """
+    Wrap a command to run on `host` over SSH.
+
+    ffmpeg runs in the background of a remote shell that kills it once the SSH
+    connection's stdin closes, so killing the local ssh process stops the remote job.
+
+    :param cwd: Directory the command runs in, so relative paths resolve like they do
+        locally. (default: the login directory)
+    """
+
+    import shlex
+
+    # Background jobs of a non-interactive shell read /dev/null, so stdin is passed on as fd 3
+    script = f"exec 3<&0; {shlex.join(command)} </dev/null & pid=$!; (cat <&3 >/dev/null; kill $pid 2>/dev/null) >/dev/null 2>&1 & wait $pid"
+    if cwd:
+        script = f"cd {shlex.quote(cwd)} || exit 1; {script}"
+    return [*ssh_command, host, shlex.join(["sh", "-c", script])]
+
+class HostPool:
+    """
+    Runs jobs on remote hosts over SSH, a given number of jobs per host at once.
+
+    By default inputs and outputs are expected on shared storage under the same paths on
+    every host, jobs run in the local working directory there. With `copy`, the input is sent to a temporary directory on the host and
+    the output is fetched back, both through the SSH connection. A failed job is retried
+    on hosts it did not run on yet, up to `retries` times.
+
+    :param hosts: A list of "host" or "host:slots" entries (e.g. ["render1:4", "user@render2"]).
+    :param ssh_command: SSH command as a list. (default: ssh in batch mode)
+    :param copy: Copy input and output over SSH instead of using shared storage.
+    :param retries: Number of retries of a failed job on other hosts.
+    """
+
+    def __init__(self, hosts, ssh_command=None, copy=False, retries=1):
+        self.slots = {}
+        for entry in hosts:
+            host, _, slots = entry.rpartition(":") if re.search(r":\d+$", entry) else (entry, "", "1")
+            self.slots[host] = self.slots.get(host, 0) + max(1, int(slots))
+
+        self.ssh_command = ssh_command or ["ssh", "-o", "BatchMode=yes"]
+        self.copy = copy
+        self.retries = retries
+        self.running = {host: 0 for host in self.slots}
+        self.condition = threading.Condition()
+        self.stopped = False
+
+    @property
+    def size(self):
+        return sum(self.slots.values())
+
+    def acquire(self, exclude=()):
+        # The least busy host with a free slot, None once every host was tried
+        with self.condition:
+            while True:
+                hosts = [host for host in self.slots if host not in exclude]
+                if not hosts:
+                    return None
+
+                free = [host for host in hosts if self.running[host] < self.slots[host]]
+                if free:
+                    host = min(free, key=lambda host: self.running[host] / self.slots[host])
+                    self.running[host] += 1
+                    return host
+                self.condition.wait()
+
+    def stop(self):
+        self.stopped = True
+
+    def release(self, host):
+        with self.condition:
+            self.running[host] -= 1
+            self.condition.notify_all()
+
+    def ssh(self, host, script, stdin=None, stdout=None):
+        import subprocess
+
+        command = [*self.ssh_command, host, script]
+        return subprocess.run(command, stdin=stdin or subprocess.DEVNULL, stdout=stdout or subprocess.DEVNULL, stderr=subprocess.PIPE).returncode
+
+    def run_copy(self, host, args, pos_args, input_file, prefix, state):
+        import shlex
+        import uuid
+
+        input_path, output_path = args[args.index("-i") + 1], args[-1]
+        remote_directory = f"/tmp/ffmpegp-{uuid.uuid4().hex}"
+        remote_input = f"{remote_directory}/input{os.path.splitext(input_path)[1]}"
+        remote_output = f"{remote_directory}/{os.path.basename(output_path)}"
+
+        try:
+            with open(input_path, "rb") as file:
+                if self.ssh(host, f"mkdir -p {shlex.quote(remote_directory)} && cat > {shlex.quote(remote_input)}", stdin=file) != 0:
+                    state.add_line(f"Could not copy \"{input_path}\" to {host}.")
+                    state.finish("\n".join(state.stdline))
+                    return 255
+
+            remote_args = list(args)
+            remote_args[remote_args.index("-i") + 1] = remote_input
+            remote_args[-1] = remote_output
+
+            returncode = start_process(args=remote_args, pos_args=pos_args, input_file=input_file, prefix=prefix, state=state)
+            if returncode == 0:
+                with open(output_path, "wb") as file:
+                    if self.ssh(host, f"cat {shlex.quote(remote_output)}", stdout=file) != 0:
+                        return 255
+            return returncode
+
+        finally:
+            self.ssh(host, f"rm -rf {shlex.quote(remote_directory)}")
+
+    def run(self, args, pos_args, input_file, prefix='', state=None):
+        """
+        Run a job like start_process, on the hosts of the pool.
+        """
+
+        state = state or JobState()
+        tried = []
+        returncode = None
+
+        while True:
+            host = self.acquire(exclude=tried)
+            if host is None:
+                return returncode
+            tried.append(host)
+
+            state.host = host
+            state.ssh_command = self.ssh_command
+            # On shared storage the job runs in the local working directory, copied jobs use absolute paths
+            state.remote_cwd = None if self.copy else os.getcwd()
+            try:
+                if self.copy:
+                    returncode = self.run_copy(host, args, pos_args, input_file, f"{prefix}[{host}] ", state)
                 else:
-                    return True
+                    returncode = start_process(args=args, pos_args=pos_args, input_file=input_file, prefix=f"{prefix}[{host}] ", state=state)
+            finally:
+                self.release(host)
 
+            # Jobs killed on interrupt are not retried
+            if returncode == 0 or self.stopped or len(tried) > self.retries:
+                return returncode
 
-def read_pipe(process, pipe, pos_args, input_file, prefix):
-    global error, stdline
-    progress = None
-    frame = False
-    stream = False
+            state.log(f"{prefix}failed on {host} (exit code {returncode}), retrying on another host.")
+            state.reset()
 
-    while True:
-        line = pipe.readline()
-        if not line:
-            break
-        text = line.strip()
-        stdline.append(text)
+def get_opt(opt_args, key, default=None):
+    # Values given as '--key=a,b' are split into a list, '--key a' is kept as a string.
+    value = opt_args.get(key)
+    if isinstance(value, list):
+        value = ",".join(value)
+    return value if value else default
 
-        if "Duration" in text and not stream:
-            # Capture start time
-            start_time = time.time()
+def get_jobs(opt_args):
+    jobs = get_opt(opt_args, "--jobs")
+    if not jobs:
+        return os.cpu_count() or 1
 
-            # Scrap total_duration
-            total_duration = text.split()[1].strip(",")
-            stream = True
+    try:
+        return max(1, int(jobs))
+    except ValueError:
+        print(f"provided '--jobs' value '{jobs}' is not a number.")
+        sys.exit(1)
 
-        if stream and ("frame=" in text.split() or "size=" in text or "time=" in text):
-            part_duration = extract_time(text)
-            speed = text.split()[-1].split("=")[-1]
+def get_host_pool(opt_args, pos_args):
+    import shlex
 
-            if part_duration != "N/A" or speed != "N/A":
-                try:
-                    # Convert durations to seconds
-                    total_seconds = duration_to_seconds(total_duration)
-                    part_seconds = duration_to_seconds(part_duration)
-                    iteration, total = map(lambda x : round(x, 0), [part_seconds, total_seconds])
-                    frame = True
-
-                    if error:
-                        if '--log' in pos_args:
-                            print("\n".join(stdline[:-1]))
-                        else:
-                            for index, path in enumerate(input_file):
-                                inputs = []
-                                path = path.replace("\"", "")
-                                if "--stdout" in pos_args:
-                                    inputs.append(f"input{index}:\"{path}\"")
-                                else:
-                                    print(f"Input #{index}: from \"{path}\"")
-
-                            # if "--stdout" in pos_args:
-                            #     print(json.dumps({
-                            #         "input": inputs
-                            #     }))
-                    
-                    if "--stdout" in pos_args:
-                        suffix = f"speed={speed}"
-                    elif "--colored" in pos_args:
-                        colors = [(240, 120, 255), (255, 250, 100)]  # Pink -> Yellow
-                        suffix = f'{gradient_text(f"speed:{speed}", colors)}'
-                    else:
-                        suffix = f"\33[92mspeed:{speed}\33[0m"
+    hosts = [host for host in get_opt(opt_args, "--hosts", "").split(",") if host]
+    if not hosts:
+        return None
 
-                    progress = print_progress_bar(start_time, iteration, total, pos_args, prefix=prefix, suffix=suffix)
-                    if progress == "OK":
-                        break
-                    error = False
-                except Exception:
-                    break
+    retries = get_opt(opt_args, "--retries", "1")
+    try:
+        retries = max(0, int(retries))
+    except ValueError:
+        print(f"provided '--retries' value '{retries}' is not a number.")
+        sys.exit(1)
 
-    # Close the pipe after reading
-    pipe.close()
+    ssh_command = shlex.split(get_opt(opt_args, "--ssh", "")) or None
+    return HostPool(hosts, ssh_command=ssh_command, copy="--remote-copy" in pos_args, retries=retries)
 
-    # Wait for the process to complete
-    process.wait()
+def get_split(opt_args):
+    split = get_opt(opt_args, "--split")
+    if not split:
+        return 1
 
-    if process.returncode == 0 and stream and frame and progress != "OK":
-        print_progress_bar(start_time, total, total, pos_args, prefix=prefix, suffix=suffix)
+    try:
+        return max(1, int(split))
+    except ValueError:
+        print(f"provided '--split' value '{split}' is not a number.")
+        sys.exit(1)
 
-def start_process(args, pos_args, input_file, prefix='', pid=None):
-    global error, stdline
+def get_log_lines(opt_args):
+    log_lines = get_opt(opt_args, "--log-lines")
+    if not log_lines:
+        return LOG_LINES
 
     try:
-        command = f"ffmpeg {' '.join(args)}"
-        if input_filenames:
-            command = command + " -y"
-        process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, shell=True, text=True, encoding='utf-8')
-        pid = process.pid
-
-        # Threads to read stdout and stderr
-        stdout_thread = threading.Thread(target=read_pipe, args=(process, process.stdout, pos_args, input_file, prefix))
-        stderr_thread = threading.Thread(target=read_pipe, args=(process, process.stderr, pos_args, input_file, prefix))
-
-        # Start the threads
-        stdout_thread.start()
-        stderr_thread.start()
-
-        # Wait for both threads to complete
-        stdout_thread.join()
-        stderr_thread.join()
-                
-        if error:
-            output = "\n".join(stdline)
-            print(output.replace("usage: ffmpeg", f"usage: ffmpegp").strip())
-        else:
-            print()
+        return max(1, int(log_lines))
+    except ValueError:
+        print(f"provided '--log-lines' value '{log_lines}' is not a number.")
+        sys.exit(1)
 
-        # Set global variables to their initial values.
-        error = True
-        stdline = []
+def run_jobs(jobs, max_jobs, pos_args, log_lines=LOG_LINES, log_file=None, board=None, on_finish=None, scheduler=None, command_prefix=None, metrics=None, hosts=None):
+    """
+    Run prepared jobs with up to `max_jobs` ffmpeg processes at once.
+
+    Jobs are pulled from `jobs` only when a worker is free, so a generator
+    can keep scanning while the first jobs already run. A generator that waits
+    for new files can yield None to let finished jobs be collected meanwhile.
+
+    :param jobs: An iterable of (args, input_file, prefix) tuples.
+    :param max_jobs: Maximum number of concurrently running processes.
+    :param pos_args: Positional flags of the current invocation.
+    :param log_lines: Number of log lines kept in memory per job.
+    :param log_file: Optional LogFile receiving the full log of every job.
+    :param board: ProgressBoard of parallel jobs. (default: a new board)
+    :param on_finish: Optional callback called with (job, returncode) in the calling thread.
+    :param scheduler: Optional LoadScheduler deciding when another job may start below `max_jobs`.
+    :param command_prefix: Optional command put in front of every ffmpeg call (see get_priority_command).
+    :param metrics: Optional Metrics receiving the summary of every job.
+    :param hosts: Optional HostPool running the jobs remotely, `max_jobs` is then its number of slots.
+    """
 
-    except (EOFError, KeyboardInterrupt):
-        if pid:
+    launch = hosts.run if hosts else start_process
+    if hosts:
+        max_jobs = hosts.size
+
+    if max_jobs == 1:
+        for job in jobs:
+            if job is None:
+                continue
+            args, input_file, prefix = job
+            state = JobState(log_lines=log_lines, log_file=log_file, log_prefix=prefix)
+            state.command_prefix = command_prefix or []
+            state.batch = True
+            state.metrics = metrics
+            state.output_stat = get_output_stat(args[-1])
             try:
-                os.kill(process.pid, 9)
-            except Exception:
-                pass
-        print("\nProgram interrupted!")
-        sys.exit(1)
+                returncode = launch(args=args, pos_args=pos_args, input_file=input_file, prefix=prefix, state=state)
+            except (SystemExit, KeyboardInterrupt):
+                # start_process exits after stopping an interrupted ffmpeg
+                remove_output(args[-1], state.output_stat)
+                raise
+            if returncode:
+                remove_output(args[-1], state.output_stat)
+            if on_finish:
+                on_finish(job, returncode)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    board = board or ProgressBoard(plain="--stdout" in pos_args)
+    executor = ThreadPoolExecutor(max_workers=max_jobs)
+    futures = {}
+
+    def collect(done):
+        for future in done:
+            state, job = futures.pop(future)
+            returncode = future.result()
+            if returncode:
+                remove_output(job[0][-1], state.output_stat)
+            if on_finish:
+                on_finish(job, returncode)
+
+    try:
+        for index, job in enumerate(jobs):
+            if job is None:
+                collect(wait(futures, timeout=0).done)
+                continue
+
+            # Wait for a free slot, and with a scheduler also for spare CPU and memory.
+            # One job always runs, so a busy machine still makes progress.
+            while futures:
+                if len(futures) >= max_jobs:
+                    timeout = None
+                elif not scheduler or scheduler.admit():
+                    break
+                else:
+                    timeout = scheduler.interval
+
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            args, input_file, prefix = job
+            state = JobState(display=board, key=index, log_lines=log_lines, log_file=log_file, log_prefix=prefix)
+            state.command_prefix = command_prefix or []
+            state.batch = True
+            state.metrics = metrics
+            state.output_stat = get_output_stat(args[-1])
+            futures[executor.submit(launch, args=args, pos_args=pos_args, input_file=input_file, prefix=prefix, state=state)] = state, job
+            if scheduler:
+                scheduler.started()
 
-try:
-    raw_args = sys.argv[1:]
-except Exception:
-    pass
+        collect(wait(futures).done)
+        executor.shutdown()
+
+    except (EOFError, KeyboardInterrupt):
+        # Jobs that finished while no one was waiting are complete, record them first
+        collect([future for future in futures if future.done()])
+        executor.shutdown(wait=False, cancel_futures=True)
+        if hosts:
+            hosts.stop()
+        kill_jobs([state for state, job in futures.values()])
+        for state, job in futures.values():
+            remove_output(job[0][-1], state.output_stat)
+        raise
+
+def __getattr__(name):
+    # The asyncio API lives in ffmpegp.aio and is only imported on first use
+    if name in ("run", "Job", "JobResult", "Progress"):
+        from . import aio
+        return getattr(aio, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def main(argv=None):
+    import json
+
+    raw_args = list(sys.argv[1:] if argv is None else argv)
+    input_filenames.clear()
+    check_binaries()
+    log_file = None
+    metrics = None
 
-def main():    
     try:
         args = []
         pos_args = []
         mode = "single"
-        skip_pos_args = ["--colored", "--stdout", "help", "--log", "-y"]
-        skip_opt_args = ["--jq", "--dir", "--format="]
+        skip_pos_args = ["--colored", "--stdout", "help", "--log", "-y", "--no-cache", "--cache-stats", "--recursive", "--skip-existing", "--if-newer", "--load-aware", "--auto-copy", "--watch", "--remote-copy"]
+        skip_opt_args = ["--jq", "--dir", "--format=", "--jobs", "--probe-dir", "--log-lines", "--log-file", "--include", "--exclude", "--manifest", "--split", "--order", "--nice", "--ionice", "--summary", "--metrics-file", "--queue", "--outputs", "--hosts", "--ssh", "--retries", "--thumbnails", "--sprite"]
         opt_args = {key.rstrip('='): [] for key in skip_opt_args}
 
         for arg in skip_pos_args:
@@ -338,25 +2873,24 @@ def main():
                 pos_args.append(arg)
                 raw_args.remove(arg)
 
-        for index, arg in enumerate(raw_args):
-            for key in opt_args:
-                if arg == key.rstrip('='):
-                    pos_args.append(arg)
-                    if index + 1 < len(raw_args):
-                        next_arg = raw_args[index + 1]
-                        if not next_arg.startswith("-"):
-                            opt_args[key.rstrip('=')] = next_arg
-                            raw_args.remove(next_arg)
-
-                elif arg.startswith(key):
-                    pos_args.append(arg)
-                    value = arg.split('=')[1].split(',')
-                    opt_args[key.rstrip('=')] = value
-
-        for arg in skip_opt_args:
-            ar = [a for a in raw_args if a.startswith(arg)]
-            if ar:
-                raw_args.remove(ar[0])
+        index = 0
+        while index < len(raw_args):
+            arg = raw_args[index]
+            key = next((key for key in opt_args if arg == key or arg.startswith(f"{key}=")), None)
+
+            if not key:
+                index += 1
+                continue
+
+            # Remove the option (and its value) by position, so equal values elsewhere stay untouched.
+            pos_args.append(key)
+            raw_args.pop(index)
+
+            if arg == key:
+                if index < len(raw_args) and not raw_args[index].startswith("-"):
+                    opt_args[key] = raw_args.pop(index)
+            else:
+                opt_args[key] = arg.split('=', 1)[1].split(',')
 
         if "help" in pos_args:
             colors = [(100, 200, 255), (255, 100, 255)]  # Cyan -> Pink
@@ -367,11 +2901,41 @@ positional:
     \33[92m--colored\33[0m      Show gradient color output
     \33[92m--log\33[0m          Show logs of running process
     \33[92m--stdout\33[0m       Turn off all colors and disable any ASCII, printing only texts.
+    \33[92m--no-cache\33[0m     Always run ffprobe, bypassing the metadata cache in ~/.cache/ffmpegp
+    \33[92m--cache-stats\33[0m  Show metadata cache location, size and hit/miss counts
+    \33[92m--skip-existing\33[0m Skip files whose output already exists. (works with '--dir' tag)
+    \33[92m--if-newer\33[0m     Only process files that are newer than their existing output. (works with '--dir' tag)
+    \33[92m--load-aware\33[0m   Start further jobs only while CPU and memory are left, up to '--jobs'. (works with '--dir' tag)
+    \33[92m--auto-copy\33[0m    Copy streams that already match the output instead of re-encoding them
+    \33[92m--watch\33[0m        Keep running and process files as they are added to the '--dir' directory
+    \33[92m--remote-copy\33[0m  Copy inputs to the '--hosts' and outputs back over SSH instead of using shared storage
+    \33[92m--recursive\33[0m    Also process files in subdirectories, keeping their structure in the output. (works with '--dir' and '--probe-dir' tags)
 
 optional:
     \33[92m--jq\33[0m           JSON path to query specific data (e.g., format.filename)
     \33[92m--dir\33[0m          Use this flag to start multi task mode. (default: current directory)
     \33[92m--format\33[0m       Set specific file format to find. (works with '--dir' tag) (default: all) (e.g., --format=mp4)
+    \33[92m--include\33[0m      Only process files matching these glob patterns. (works with '--dir' and '--probe-dir' tags) (e.g., --include="*.mp4,season*/*")
+    \33[92m--exclude\33[0m      Skip files and directories matching these glob patterns. (works with '--dir' and '--probe-dir' tags) (e.g., --exclude="*sample*")
+    \33[92m--manifest\33[0m     Record finished jobs in a file and skip them on later runs, resuming interrupted batches. (works with '--dir' tag)
+    \33[92m--outputs\33[0m      Write several outputs of one input with a single decode, each with its own options in brackets (e.g., --outputs "{}_720p.mp4[-vf scale=-2:720],{}_480p.mp4[-vf scale=-2:480]")
+    \33[92m--split\33[0m        Encode a single input as N segments in parallel, cut at keyframes and joined without re-encoding
+    \33[92m--thumbnails\33[0m   Take N evenly spaced thumbnails in a single pass and tile them into the output image, with a WebVTT index next to it
+    \33[92m--sprite\33[0m       Grid of the '--thumbnails' sprite sheet, columns x rows. (default: near square) (e.g., --sprite=5x4)
+    \33[92m--then\33[0m         Start another ffmpeg stage that reads the output of the previous one over a pipe, without intermediate files (e.g., -i in.mp4 -af loudnorm --then -vf scale=-2:720 out.mp4)
+    \33[92m--order\33[0m        Start files by estimated encoding time, 'longest' or 'shortest' first. (works with '--dir' tag) (default: listing order)
+    \33[92m--nice\33[0m         Run ffmpeg with this niceness (e.g., --nice=10)
+    \33[92m--ionice\33[0m       Run ffmpeg in this I/O scheduling class (e.g., --ionice=idle, --ionice=best-effort:7)
+    \33[92m--queue\33[0m        Queue file of '--watch', keeping track of processed files across restarts. (default: in ~/.cache/ffmpegp)
+    \33[92m--hosts\33[0m        Run the jobs on these hosts over SSH, optionally with a number of jobs per host. (works with '--dir' tag) (e.g., --hosts=render1:4,render2:2)
+    \33[92m--ssh\33[0m          SSH command used for '--hosts'. (default: "ssh -o BatchMode=yes")
+    \33[92m--retries\33[0m      Number of times a failed job is retried on another host. (works with '--hosts' tag) (default: 1)
+    \33[92m--jobs\33[0m         Number of files to process at once. (works with '--dir' tag) (default: CPU count)
+    \33[92m--log-lines\33[0m    Number of log lines kept in memory for error reports. (default: 500)
+    \33[92m--log-file\33[0m     Append the complete ffmpeg log to a file
+    \33[92m--summary\33[0m      Append a JSON summary of every job (time, speed, fps, sizes, exit code, peak memory) to a file
+    \33[92m--metrics-file\33[0m Write totals of the run to a Prometheus textfile for node_exporter
+    \33[92m--probe-dir\33[0m    Print media details of every file in a directory or glob as JSON lines (e.g., --probe-dir "videos/**/*.mp4")
 
 placeholders:
     \33[92m{}\33[0m: Represents the input filename.
@@ -395,48 +2959,152 @@ homepage: \33[4mhttps://github.com/imegeek/ffmpegp\33[0m
         try:
             file = raw_args[0]
             if os.path.isfile(file):
-                media_details = get_media_details(file)
-                if media_details:
-                    json_path = opt_args["--jq"]
-                    if json_path:
-                        # Query the JSON object using the provided JSON path
-                        query_result = query_json(media_details, json_path)
-                        if query_result:
-                            print(json.dumps(query_result, indent=4))
-                        else:
-                            print(f"No results found for the JSON path: {json_path}")
+                json_path = get_opt(opt_args, "--jq")
+                if json_path:
+                    # Probe only what the JSON path needs
+                    query_result = query_media(file, json_path, use_cache="--no-cache" not in pos_args)
+                    if query_result:
+                        print(json.dumps(query_result, indent=4))
                     else:
+                        print(f"No results found for the JSON path: {json_path}")
+                else:
+                    media_details = get_media_details(file, use_cache="--no-cache" not in pos_args)
+                    if media_details:
                         # Print full media details if no JSON path is provided
                         print(json.dumps(media_details, indent=4))
+                if "--cache-stats" in pos_args:
+                    print_cache_stats(pos_args)
                 sys.exit(0)
         except Exception:
             pass
 
+        if "--probe-dir" in pos_args:
+            target = get_opt(opt_args, "--probe-dir", os.getcwd())
+            formats = [fmt for fmt in get_opt(opt_args, "--format", "").split(",") if fmt]
+            include = [pattern for pattern in get_opt(opt_args, "--include", "").split(",") if pattern]
+            exclude = [pattern for pattern in get_opt(opt_args, "--exclude", "").split(",") if pattern]
+            paths = iter_probe_paths(target, formats, recursive="--recursive" in pos_args, include=include, exclude=exclude)
+
+            probe_files(paths, get_jobs(opt_args), json_path=get_opt(opt_args, "--jq"), use_cache="--no-cache" not in pos_args)
+            if "--cache-stats" in pos_args:
+                print_cache_stats(pos_args)
+            sys.exit(0)
+
+        if "--cache-stats" in pos_args and not raw_args:
+            print_cache_stats(pos_args)
+            sys.exit(0)
+
+        log_lines = get_log_lines(opt_args)
+        command_prefix = get_priority_command(get_opt(opt_args, "--nice"), get_opt(opt_args, "--ionice"))
+        if get_opt(opt_args, "--summary") or get_opt(opt_args, "--metrics-file"):
+            metrics = Metrics(get_opt(opt_args, "--summary"), get_opt(opt_args, "--metrics-file"))
+        if get_opt(opt_args, "--log-file"):
+            log_file = LogFile(get_opt(opt_args, "--log-file"))
+
         if "--dir" in pos_args:
             mode = "multi"
-            formats = opt_args["--format"]
+            formats = get_opt(opt_args, "--format", "").split(",")
+            formats = [fmt for fmt in formats if fmt]
+            max_jobs = get_jobs(opt_args)
             
-            if opt_args["--dir"]:
-                directory = os.path.abspath(opt_args["--dir"])
+            if get_opt(opt_args, "--dir"):
+                directory = os.path.abspath(get_opt(opt_args, "--dir"))
             else:
                 directory = os.getcwd()
         
             if not os.path.isdir(directory):
-                print(f"provided '{opt_args['--dir']}' path not exist.")
+                print(f"provided '{get_opt(opt_args, '--dir')}' path not exist.")
                 sys.exit(1)
 
-        for arg in raw_args:
-            if arg.startswith("-"):
-                args.append(arg)
-            else:
-                args.append(f"\"{arg}\"")
+        # Arguments are passed to ffmpeg as-is, without a shell in between
+        args.extend(raw_args)
 
         for index, arg in enumerate(raw_args):
             if index + 1 < len(raw_args):
                 if "-i" == arg and raw_args[index + 1]:
                     input_filenames.append(raw_args[index + 1])
 
-        if mode == "single":
+        if "--then" in raw_args:
+            if "--then" in (raw_args[0], raw_args[-1]) or any(raw_args[index:index + 2] == ["--then", "--then"] for index in range(len(raw_args))):
+                print("'--then' needs ffmpeg options on both sides of every stage.")
+                sys.exit(1)
+
+            conflicts = [option for option in ("--outputs", "--split", "--auto-copy", "--hosts") if option in pos_args]
+            if conflicts:
+                print(f"'--then' cannot be combined with '{conflicts[0]}'.")
+                sys.exit(1)
+
+        thumbnails = get_thumbnail_layout(opt_args)
+        if thumbnails:
+            conflicts = [option for option in ("--outputs", "--split", "--auto-copy") if option in pos_args]
+            if "--then" in raw_args:
+                conflicts.append("--then")
+            if conflicts:
+                print(f"'--thumbnails' and '--sprite' cannot be combined with '{conflicts[0]}'.")
+                sys.exit(1)
+
+        if mode == "single" and "--outputs" in pos_args:
+            if len(input_filenames) != 1:
+                print("'--outputs' needs exactly one input file.")
+                sys.exit(1)
+
+            outputs = parse_outputs(get_opt(opt_args, "--outputs", ""))
+            if not outputs:
+                print("provided '--outputs' value has no output files.")
+                sys.exit(1)
+
+            outputs = [(resolve_output(template, input_filenames[0]), output_args) for template, output_args in outputs]
+            for output_path, _ in outputs:
+                if os.path.abspath(input_filenames[0]) != os.path.abspath(output_path):
+                    check_file(output_filename=output_path, output_path=os.path.abspath(output_path), pos_args=pos_args)
+
+            media_details = get_media_details(input_filenames[0], use_cache="--no-cache" not in pos_args, verbose=False) or {}
+            has_video = any(stream.get("codec_type") == "video" for stream in media_details.get("streams", []))
+            args = build_output_args(args, outputs, split_video=has_video)
+
+            state = JobState(log_lines=log_lines, log_file=log_file)
+            state.command_prefix = command_prefix
+            state.metrics = metrics
+            state.outputs = [output_path for output_path, _ in outputs]
+            returncode = start_process(args=args, pos_args=pos_args, input_file=input_filenames, state=state)
+
+            if returncode == 0:
+                for index, (output_path, _) in enumerate(outputs):
+                    size = get_readable_file_size(output_path) if os.path.isfile(output_path) else "0.00 B"
+                    if "--stdout" in pos_args:
+                        print(f"output{index}:\"{output_path}\" size={size}")
+                    else:
+                        print(f"Output #{index}: to \"{output_path}\" \33[92m{size}\33[0m")
+
+        elif mode == "single" and thumbnails:
+            if len(input_filenames) != 1:
+                print("'--thumbnails' needs exactly one input file.")
+                sys.exit(1)
+
+            output_path = resolve_output(raw_args[-1], input_filenames[0])
+            args[-1] = output_path
+            if os.path.abspath(input_filenames[0]) != os.path.abspath(output_path):
+                check_file(output_filename=output_path, output_path=os.path.abspath(output_path), pos_args=pos_args)
+
+            plan = build_thumbnail_args(args, get_media_details(input_filenames[0], use_cache="--no-cache" not in pos_args, verbose=False), *thumbnails)
+            if not plan:
+                print(f"'{input_filenames[0]}' has no video stream or duration to take thumbnails from.")
+                sys.exit(1)
+            args, index_text = plan
+
+            state = JobState(log_lines=log_lines, log_file=log_file)
+            state.command_prefix = command_prefix
+            state.metrics = metrics
+            returncode = start_process(args=args, pos_args=pos_args, input_file=input_filenames, state=state)
+
+            if returncode == 0:
+                vtt_path = write_thumbnail_index(output_path, index_text)
+                if "--stdout" in pos_args:
+                    print(f"index:\"{vtt_path}\"")
+                else:
+                    print(f"Index: to \"{vtt_path}\"")
+
+        elif mode == "single":
 
             if input_filenames:
                 output_filename = raw_args[-1]
@@ -444,15 +3112,8 @@ homepage: \33[4mhttps://github.com/imegeek/ffmpegp\33[0m
                 input_path = list(map(lambda filename : os.path.abspath(filename), input_filenames))
 
                 if "{}" in output_filename:
-                    output_directory, output_filename, output_template, output_extension = extract_output(output_filename)
-
-                    directory, file = os.path.split(input_path[0])
-                    file_name, input_extension = os.path.splitext(file)
-                    if not output_extension:
-                        output_extension = input_extension
-
-                    output_path = os.path.join(output_directory, output_template.replace("{}", file_name)+output_extension)
-                    output_filename = f"\"{output_path}\""
+                    output_path = resolve_output(output_filename, input_path[0])
+                    output_filename = output_path
                     args[-1] = output_filename
                 else:
                     output_path = os.path.abspath(output_filename)
@@ -460,9 +3121,25 @@ homepage: \33[4mhttps://github.com/imegeek/ffmpegp\33[0m
                 if input_path[0] != output_path:
                     check_file(output_filename=output_filename, output_path=output_path, pos_args=pos_args)
             
-            start_process(args=args, pos_args=pos_args, input_file=input_filenames)
+            if "--auto-copy" in pos_args and len(input_filenames) == 1:
+                plan = get_copy_plan(args, get_media_details(input_filenames[0], use_cache="--no-cache" not in pos_args, verbose=False))
+                args = apply_copy_plan(args, plan)
+                print(format_copy_plan(plan, input_filenames[0], pos_args))
+
+            split = get_split(opt_args)
+            if split > 1 and len(input_filenames) == 1:
+                split_process(args=args, pos_args=pos_args, input_file=input_filenames, parts=split, log_lines=log_lines, log_file=log_file, command_prefix=command_prefix, metrics=metrics)
+            else:
+                state = JobState(log_lines=log_lines, log_file=log_file)
+                state.command_prefix = command_prefix
+                state.metrics = metrics
+                start_process(args=args, pos_args=pos_args, input_file=input_filenames, state=state)
 
         elif mode == "multi":
+            if "--outputs" in pos_args:
+                print("'--outputs' works with a single input file, not with '--dir'.")
+                sys.exit(1)
+
             if input_filenames:
                 output_filename = raw_args[-1]
 
@@ -472,28 +3149,62 @@ homepage: \33[4mhttps://github.com/imegeek/ffmpegp\33[0m
                     print("You need to include `{}` as a placeholder for matched file names.")
                     sys.exit(1)
 
-            files = []
+            recursive = "--recursive" in pos_args
+            include = [pattern for pattern in get_opt(opt_args, "--include", "").split(",") if pattern]
+            exclude = [pattern for pattern in get_opt(opt_args, "--exclude", "").split(",") if pattern]
 
-            for file in os.listdir(directory):
-                full_path = os.path.join(directory, file)
+            # Never pick up our own outputs while walking the tree
+            skip_dirs = [os.path.abspath(output_directory or os.getcwd())]
+            files = iter_media_files(directory, formats, recursive=recursive, include=include, exclude=exclude, skip_dirs=skip_dirs)
 
-                if os.path.isfile(full_path):
-                    if not formats:
-                        files.append(full_path)
-                    elif any(file.endswith(fmt) for fmt in formats):
-                        files.append(full_path)
-
-            if len(files) == 0:
-                print(f"provided '{directory}' path is empty.")
+            order = get_opt(opt_args, "--order")
+            if order and order not in ("longest", "shortest"):
+                print(f"provided '--order' value '{order}' is not one of: longest, shortest.")
                 sys.exit(1)
-            else:
-                path = directory
-                file_count = len(files)
-                file_string = "files" if file_count > 1 else "file"
-                print(f"[{file_count} {file_string}] loaded from {path}\n")
 
-            for index, path in enumerate(files):
-                directory, file = os.path.split(path)
+            watch = "--watch" in pos_args
+            if watch:
+                file_count = None
+            elif recursive and not order:
+                # Jobs start while the tree is still being scanned, so the total is unknown
+                file_count = None
+                print(f"[scanning] {directory}\n")
+            else:
+                files = list(files)
+                if len(files) == 0:
+                    print(f"provided '{directory}' path is empty.")
+                    sys.exit(1)
+                else:
+                    path = directory
+                    file_count = len(files)
+                    file_string = "files" if file_count > 1 else "file"
+                    print(f"[{file_count} {file_string}] loaded from {path}\n")
+
+                if order:
+                    files = order_files(files, order, max_jobs, use_cache="--no-cache" not in pos_args)
+
+            hosts = get_host_pool(opt_args, pos_args)
+            if hosts:
+                max_jobs = hosts.size
+
+            board = ProgressBoard(plain="--stdout" in pos_args) if max_jobs > 1 else None
+            manifest = Manifest(get_opt(opt_args, "--manifest")) if get_opt(opt_args, "--manifest") else None
+            incremental = manifest or watch or "--skip-existing" in pos_args or "--if-newer" in pos_args
+            manifest_keys = {}
+            thumbnail_indexes = {}
+            # Absolute paths of all outputs of this run, which are never taken as inputs
+            job_outputs = set()
+            copy_counts = {"remux": 0, "partial": 0, "transcode": 0}
+            scanned = 0
+            skipped = 0
+
+            def make_job(index, path):
+                nonlocal skipped
+
+                if os.path.abspath(path) in job_outputs:
+                    return None
+
+                relative_directory, file = os.path.split(os.path.relpath(path, directory))
                 file_name, input_extension = os.path.splitext(file)
 
                 if not output_extension:
@@ -501,22 +3212,154 @@ homepage: \33[4mhttps://github.com/imegeek/ffmpegp\33[0m
                 else:
                     extension = output_extension
 
-                input_filename = f"\"{path}\""
-                output_path = os.path.join(output_directory, output_template.replace("{}", file_name)+extension)
-                output_filename = f"\"{output_path}\""
+                input_filename = path
+                output_path = os.path.join(output_directory, relative_directory, output_template.replace("{}", file_name)+extension)
+                output_filename = output_path
+                job_outputs.add(os.path.abspath(output_path))
+
+                if os.path.realpath(output_path) == os.path.realpath(input_filename):
+                    text = f"{os.path.relpath(input_filename, directory)}: output is the same file as the input, skipped"
+                    board.log(text) if board else print(text)
+                    return None
+
+                if relative_directory:
+                    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+                job_args = list(args)
+                job_args[job_args.index("-i") + 1] = input_filename
+                job_args[-1] = output_filename
+
+                if is_up_to_date(input_filename, output_path, pos_args):
+                    skipped += 1
+                    return None
+
+                if manifest:
+                    # A different thumbnail layout is a different job
+                    key = manifest.key(input_filename, job_args + [f"--thumbnails={':'.join(map(str, thumbnails))}"] if thumbnails else job_args)
+                    if manifest.is_done(key, output_path):
+                        skipped += 1
+                        return None
+                    manifest_keys[output_path] = key
+
+                # Incremental runs overwrite stale or unfinished outputs without asking
+                if not incremental:
+                    check_skip = check_file(skip=True, output_filename=output_filename, output_path=output_path, pos_args=pos_args, display=board)
+                    if check_skip:
+                        return None
+
+                prefix = f"{index+1:02}/{file_count:02} " if file_count else f"{index+1:02} "
+
+                if "--auto-copy" in pos_args:
+                    plan = get_copy_plan(job_args, get_media_details(input_filename, use_cache="--no-cache" not in pos_args, verbose=False))
+                    job_args = apply_copy_plan(job_args, plan)
+                    copy_counts[describe_copy_plan(plan)] += 1
+                    text = prefix + format_copy_plan(plan, os.path.relpath(input_filename, directory), pos_args)
+                    board.log(text) if board else print(text)
+
+                if thumbnails:
+                    plan = build_thumbnail_args(job_args, get_media_details(input_filename, use_cache="--no-cache" not in pos_args, verbose=False), *thumbnails)
+                    if not plan:
+                        text = f"{prefix}{os.path.relpath(input_filename, directory)}: no video stream or duration to take thumbnails from"
+                        board.log(text) if board else print(text)
+                        return None
+                    job_args, thumbnail_indexes[output_path] = plan
+                    job_outputs.add(os.path.splitext(os.path.abspath(output_path))[0] + ".vtt")
+
+                return job_args, [input_filename], prefix
+
+            def iter_jobs():
+                nonlocal scanned
+
+                for index, path in enumerate(files):
+                    scanned += 1
+                    job = make_job(index, path)
+                    if job:
+                        yield job
+
+            def iter_watch_jobs():
+                index = 0
+                while True:
+                    for path in watcher.poll():
+                        queue.add(path)
+
+                    for path in queue.take():
+                        job = make_job(index, path)
+                        index += 1
+                        if job:
+                            yield job
+                        else:
+                            queue.finish(path, True)
+
+                    # Lets run_jobs collect finished jobs while no file arrives
+                    yield None
+
+            def on_finish(job, returncode):
+                job_args, input_file, prefix = job
+                key = manifest_keys.pop(job_args[-1], None)
+                if key and returncode == 0:
+                    manifest.record(key, input_file[0], job_args[-1])
+                if watch:
+                    queue.finish(input_file[0], returncode == 0)
+                    if returncode == 0:
+                        queue.record_output(os.path.abspath(job_args[-1]))
+                index_text = thumbnail_indexes.pop(job_args[-1], None)
+                if index_text and returncode == 0:
+                    vtt_path = write_thumbnail_index(job_args[-1], index_text)
+                    if watch:
+                        queue.record_output(os.path.abspath(vtt_path))
+
+            if watch:
+                import hashlib
+
+                def accept(path):
+                    # Outputs may be written into the watched directory, they must not be processed again
+                    if os.path.abspath(path) in job_outputs:
+                        return False
+                    relative_path = os.path.relpath(path, directory).replace(os.sep, "/")
+                    if formats and not any(path.endswith(fmt) for fmt in formats):
+                        return False
+                    if include and not match_patterns(relative_path, include):
+                        return False
+                    return not (exclude and match_patterns(relative_path, exclude))
+
+                queue_path = get_opt(opt_args, "--queue") or os.path.join(get_cache_dir(), "watch", hashlib.sha1(directory.encode()).hexdigest()[:16] + ".sqlite")
+                queue = WatchQueue(queue_path)
+                watcher = DirectoryWatcher(directory, accept, recursive=recursive, skip_dirs=skip_dirs)
+                print(f"[watching] {directory} ({watcher.method}, queue: {queue_path})\n")
+                jobs = iter_watch_jobs()
+            else:
+                jobs = iter_jobs()
 
-                args[args.index("-i") + 1] = input_filename
-                args[-1] = output_filename
+            # The local load says nothing about remote hosts
+            scheduler = LoadScheduler() if "--load-aware" in pos_args and not hosts else None
 
-                check_skip = check_file(skip=True, output_filename=output_filename, output_path=output_path, pos_args=pos_args)
-                if check_skip:
-                    continue
+            run_jobs(jobs, max_jobs, pos_args, log_lines=log_lines, log_file=log_file, board=board, on_finish=on_finish if manifest or watch or thumbnails else None, scheduler=scheduler, command_prefix=command_prefix, metrics=metrics, hosts=hosts)
+
+            if not scanned:
+                print(f"provided '{directory}' path is empty.")
+                sys.exit(1)
 
-                start_process(args=args, pos_args=pos_args, input_file=[input_filename], prefix=f"{index+1:02}/{file_count:02} ")
+            if skipped:
+                file_string = "files" if skipped > 1 else "file"
+                print(f"[{skipped} {file_string}] skipped, already up to date.")
+
+            if "--auto-copy" in pos_args and any(copy_counts.values()):
+                counts = []
+                for mode, label in (("remux", "remuxed"), ("partial", "partially copied"), ("transcode", "transcoded")):
+                    if copy_counts[mode]:
+                        file_string = "files" if copy_counts[mode] > 1 else "file"
+                        counts.append(f"[{copy_counts[mode]} {file_string}] {label}")
+                print(", ".join(counts) + ".")
 
     except (EOFError, KeyboardInterrupt):
         print("\nProgram interrupted!")
         sys.exit(1)
 
+    finally:
+        if log_file:
+            log_file.close()
+        if metrics:
+            metrics.write_metrics()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
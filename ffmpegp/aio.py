@@ -0,0 +1,215 @@
+import os
+import time
+import signal
+import asyncio
+from collections import namedtuple, deque
+
+from . import LOG_LINES, ProgressParser, get_duration
+
+Progress = namedtuple("Progress", ["time", "frame", "fps", "speed", "size", "percent", "done"])
+Progress.__doc__ = """
+Progress of a running job, built from one `ffmpeg -progress` block.
+
+:param time: Output position in seconds.
+:param frame: Number of encoded frames (None for audio-only outputs).
+:param fps: Encoding speed in frames per second.
+:param speed: Encoding speed as a realtime factor (e.g. 2.5 for "2.5x").
+:param size: Output size in bytes.
+:param percent: Progress in percent, or None when the input duration is unknown.
+:param done: True for the last block of the job.
+"""
+
+def to_number(value, cast=float):
+    try:
+        return cast(value.rstrip("x").strip())
+    except (AttributeError, ValueError):
+        return None
+
+class JobResult:
+    """
+    Result of a finished job.
+
+    :param returncode: Exit code of ffmpeg.
+    :param elapsed: Wall time of the job in seconds.
+    :param progress: The last Progress reported by ffmpeg, if any.
+    :param log: The last ffmpeg log lines (stderr).
+    :param cancelled: True if the job was cancelled.
+    """
+
+    def __init__(self, returncode, elapsed, progress, log, cancelled=False):
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.progress = progress
+        self.log = log
+        self.cancelled = cancelled
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and not self.cancelled
+
+    def __repr__(self):
+        return f"JobResult(returncode={self.returncode}, elapsed={self.elapsed:.2f}, cancelled={self.cancelled})"
+
+class Job:
+    """
+    A single ffmpeg process driven from asyncio.
+
+    Iterate the job with `async for` to receive Progress updates, then `await job.wait()`
+    for the JobResult. Progress is read from `-progress pipe:1`, so no threads are used.
+
+    :param args: ffmpeg arguments as a list, without the leading "ffmpeg".
+    :param total_duration: Expected output duration in seconds, used for `percent`.
+        (default: probed from the first local `-i` input)
+    :param ffmpeg: ffmpeg executable to run.
+    :param log_lines: Number of log lines kept in memory. (default: 500)
+    """
+
+    def __init__(self, args, total_duration=None, ffmpeg="ffmpeg", log_lines=LOG_LINES):
+        self.args = list(args)
+        self.total_duration = total_duration
+        self.ffmpeg = ffmpeg
+        self.process = None
+        self.progress = None
+        self.log = deque(maxlen=log_lines)
+        self.cancelled = False
+        self.start_time = None
+        self.queue = asyncio.Queue()
+        self.readers = []
+
+    async def start(self):
+        if self.total_duration is None:
+            inputs = [self.args[index + 1] for index, arg in enumerate(self.args[:-1]) if arg == "-i"]
+            if inputs and os.path.isfile(inputs[0]):
+                self.total_duration = await asyncio.to_thread(get_duration, inputs[0])
+
+        self.start_time = time.time()
+        self.process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-progress", "pipe:1", "-nostats", *self.args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # Keep terminal signals away from ffmpeg, cancel() decides how it is stopped
+            start_new_session=os.name == "posix",
+        )
+        self.readers = [
+            asyncio.create_task(self.read_progress()),
+            asyncio.create_task(self.read_log()),
+        ]
+        return self
+
+    async def read_progress(self):
+        parser = ProgressParser()
+
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+
+            block = parser.feed(line.decode("utf-8", "replace").strip())
+            if not block:
+                continue
+
+            seconds = to_number(block.get("out_time_us"), int)
+            seconds = seconds / 1_000_000 if seconds is not None and seconds >= 0 else None
+            done = block.get("progress") == "end"
+
+            percent = None
+            if self.total_duration and seconds is not None:
+                percent = 100.0 if done else min(100.0, 100 * seconds / self.total_duration)
+
+            self.progress = Progress(
+                time=seconds,
+                frame=to_number(block.get("frame"), int),
+                fps=to_number(block.get("fps")),
+                speed=to_number(block.get("speed")),
+                size=to_number(block.get("total_size"), int),
+                percent=percent,
+                done=done,
+            )
+            self.queue.put_nowait(self.progress)
+
+        self.queue.put_nowait(None)
+
+    async def read_log(self):
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                break
+            self.log.append(line.decode("utf-8", "replace").rstrip())
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.process is None:
+            await self.start()
+
+        progress = await self.queue.get()
+        if progress is None:
+            # Let later iterations end immediately as well
+            self.queue.put_nowait(None)
+            raise StopAsyncIteration
+        return progress
+
+    async def wait(self):
+        if self.process is None:
+            await self.start()
+
+        await asyncio.gather(*self.readers)
+        returncode = await self.process.wait()
+        return JobResult(returncode, time.time() - self.start_time, self.progress, list(self.log), self.cancelled)
+
+    async def cancel(self, timeout=5):
+        """
+        Stop ffmpeg and wait for it to exit.
+
+        ffmpeg first gets SIGTERM, which lets it finalize the output, and is killed if it
+        is still running after `timeout` seconds.
+        """
+
+        if self.process is None or self.process.returncode is not None:
+            return
+
+        self.cancelled = True
+        try:
+            if os.name == "posix":
+                os.killpg(self.process.pid, signal.SIGTERM)
+            else:
+                self.process.terminate()
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            if os.name == "posix":
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+            await self.process.wait()
+        except ProcessLookupError:
+            pass
+
+async def run(args, on_progress=None, total_duration=None, ffmpeg="ffmpeg"):
+    """
+    Run ffmpeg and return its JobResult.
+
+    >>> result = await ffmpegp.run(["-i", "input.mp4", "output.mkv"], on_progress=print)
+
+    :param args: ffmpeg arguments as a list, without the leading "ffmpeg".
+    :param on_progress: Optional callback (plain function or coroutine function) called with every Progress.
+    :param total_duration: Expected output duration in seconds. (default: probed from the first input)
+    :param ffmpeg: ffmpeg executable to run.
+    """
+
+    job = Job(args, total_duration=total_duration, ffmpeg=ffmpeg)
+    await job.start()
+
+    try:
+        async for progress in job:
+            if on_progress:
+                result = on_progress(progress)
+                if asyncio.iscoroutine(result):
+                    await result
+        return await job.wait()
+
+    except BaseException:
+        # Cancellation of the awaiting task (or a failing callback) must not leave ffmpeg running
+        await asyncio.shield(job.cancel())
+        raise
@@ -0,0 +1,38 @@
+import time
+import shutil
+import asyncio
+
+import pytest
+
+import ffmpegp
+
+pytestmark = pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg is not installed")
+
+
+def test_run_reports_progress():
+    updates = []
+    args = ["-f", "lavfi", "-i", "testsrc=duration=2:rate=25", "-f", "null", "-"]
+
+    result = asyncio.run(ffmpegp.run(args, on_progress=updates.append, total_duration=2))
+
+    assert result.ok
+    assert updates and updates[-1].done
+    assert updates[-1].percent == 100.0
+    assert updates[-1].frame == 50
+
+
+def test_cancel_stops_ffmpeg():
+    args = ["-re", "-f", "lavfi", "-i", "testsrc=duration=60", "-f", "null", "-"]
+
+    async def cancel_after_first_update():
+        job = await ffmpegp.Job(args).start()
+        async for progress in job:
+            break
+        await job.cancel()
+        return await job.wait()
+
+    start = time.time()
+    result = asyncio.run(cancel_after_first_update())
+
+    assert result.cancelled and not result.ok
+    assert time.time() - start < 30
@@ -0,0 +1,63 @@
+import ffmpegp
+
+
+def media(video="h264", audio="aac"):
+    streams = []
+    if video:
+        streams.append({"codec_type": "video", "codec_name": video})
+    if audio:
+        streams.append({"codec_type": "audio", "codec_name": audio})
+    return {"streams": streams, "format": {"duration": "10.0"}}
+
+
+def test_matching_streams_are_copied():
+    assert ffmpegp.get_copy_plan(["-i", "in.mkv", "out.mp4"], media()) == {"video": True, "audio": True}
+    assert ffmpegp.get_copy_plan(["-i", "in.mkv", "-c:v", "libx264", "out.mp4"], media()) == {"video": True, "audio": True}
+
+
+def test_other_encoder_is_encoded():
+    plan = ffmpegp.get_copy_plan(["-i", "in.mkv", "-c:v", "libx265", "out.mp4"], media())
+    assert plan == {"video": False, "audio": True}
+
+
+def test_codec_option_with_stream_specifier():
+    args = ["-i", "in.mkv", "-c:v:0", "libx265", "-x265-params", "crf=28", "out.mp4"]
+    assert ffmpegp.get_copy_plan(args, media()) == {"video": False, "audio": True}
+
+    args = ["-i", "in.mkv", "-codec:a:0", "libopus", "out.mkv"]
+    assert ffmpegp.get_copy_plan(args, media()) == {"video": True, "audio": False}
+
+
+def test_encoder_settings_prevent_copy():
+    for settings in (["-preset", "veryslow"], ["-tune", "film"], ["-x264-params", "keyint=60"], ["-b:v", "2M"]):
+        args = ["-i", "in.mkv", "-vcodec", "libx264", *settings, "out.mp4"]
+        assert ffmpegp.get_copy_plan(args, media()) == {"video": False, "audio": True}, settings
+
+    # Unknown options without a stream type may configure either encoder
+    args = ["-i", "in.mkv", "-c:v", "libx264", "-row-mt", "1", "out.mp4"]
+    assert ffmpegp.get_copy_plan(args, media()) == {"video": False, "audio": False}
+
+
+def test_muxer_options_keep_copy():
+    args = ["-i", "in.mkv", "-map", "0", "-movflags", "+faststart", "-metadata", "title=x", "out.mp4"]
+    assert ffmpegp.get_copy_plan(args, media()) == {"video": True, "audio": True}
+
+
+def test_filters_and_cuts_are_encoded():
+    assert ffmpegp.get_copy_plan(["-i", "in.mkv", "-vf", "scale=-2:720", "out.mkv"], media()) == {"video": False, "audio": True}
+    assert ffmpegp.get_copy_plan(["-ss", "5", "-i", "in.mkv", "out.mkv"], media()) == {"video": False, "audio": False}
+
+
+def test_container_decides_without_encoder():
+    assert ffmpegp.get_copy_plan(["-i", "in.mkv", "out.webm"], media()) == {"video": False, "audio": False}
+    assert ffmpegp.get_copy_plan(["-i", "in.mkv", "-vn", "out.m4a"], media()) == {"audio": True}
+
+
+def test_apply_copy_plan():
+    args = ["-i", "in.mkv", "-c:v:0", "libx264", "-c:a", "libopus", "out.mkv"]
+    assert ffmpegp.apply_copy_plan(args, {"video": True, "audio": False}) == ["-i", "in.mkv", "-c:a", "libopus", "-c:v", "copy", "out.mkv"]
+
+    # A codec option for both types stays for the encoded one, the copy overrides it for the other
+    args = ["-i", "in.mkv", "-c", "libx264", "out.mkv"]
+    assert ffmpegp.apply_copy_plan(args, {"video": False, "audio": True}) == ["-i", "in.mkv", "-c", "libx264", "-c:a", "copy", "out.mkv"]
+    assert ffmpegp.apply_copy_plan(args, {"video": True, "audio": True}) == ["-i", "in.mkv", "-c:v", "copy", "-c:a", "copy", "out.mkv"]
@@ -0,0 +1,59 @@
+import ffmpegp
+
+
+def test_parse_outputs_keeps_commas_in_brackets():
+    outputs = ffmpegp.parse_outputs("{}_720p.mp4[-vf scale=-2:720,fps=30 -b:v 3M], {}_480p.mp4")
+    assert outputs == [("{}_720p.mp4", ["-vf", "scale=-2:720,fps=30", "-b:v", "3M"]), ("{}_480p.mp4", [])]
+
+
+def test_parse_outputs_quoted_arguments():
+    outputs = ffmpegp.parse_outputs('a.mkv[-metadata "title=A, B"]')
+    assert outputs == [("a.mkv", ["-metadata", "title=A, B"])]
+
+
+def test_shared_options_are_repeated_per_output():
+    args = ["-ss", "5", "-i", "in.mp4", "-c:v", "libx264", "-c:a", "aac"]
+    outputs = [("a.mp4", ["-b:v", "3M"]), ("b.mp4", ["-b:v", "1M"])]
+
+    assert ffmpegp.build_output_args(args, outputs) == [
+        "-ss", "5", "-i", "in.mp4",
+        "-c:v", "libx264", "-c:a", "aac", "-b:v", "3M", "a.mp4",
+        "-c:v", "libx264", "-c:a", "aac", "-b:v", "1M", "b.mp4",
+    ]
+
+
+def test_filtered_and_unfiltered_outputs_share_one_decode():
+    args = ["-i", "in.mp4", "-c:v", "libx264"]
+    outputs = [("a.mp4", ["-vf", "scale=-2:720", "-b:v", "3M"]), ("b.mp4", [])]
+
+    assert ffmpegp.build_output_args(args, outputs) == [
+        "-i", "in.mp4",
+        "-filter_complex", "[0:v]split=2[s0][s1];[s0]scale=-2:720[v0];[s1]null[v1]",
+        "-map", "[v0]", "-map", "0:a?", "-c:v", "libx264", "-b:v", "3M", "a.mp4",
+        "-map", "[v1]", "-map", "0:a?", "-c:v", "libx264", "b.mp4",
+    ]
+
+
+def test_no_split_without_video():
+    args = ["-i", "in.wav"]
+    outputs = [("a.mp3", ["-af", "volume=2"]), ("b.mp3", ["-vf", "null"])]
+
+    assert ffmpegp.build_output_args(args, outputs, split_video=False) == ["-i", "in.wav", "-af", "volume=2", "a.mp3", "-vf", "null", "b.mp3"]
+
+
+def test_explicit_mapping_is_passed_through():
+    args = ["-i", "in.mp4", "-map", "0:v:0"]
+    outputs = [("a.mp4", ["-vf", "scale=-2:720"]), ("b.mp4", [])]
+    assert ffmpegp.build_output_args(args, outputs) == [
+        "-i", "in.mp4",
+        "-map", "0:v:0", "-vf", "scale=-2:720", "a.mp4",
+        "-map", "0:v:0", "b.mp4",
+    ]
+
+    args = ["-i", "in.mp4", "-i", "logo.png"]
+    outputs = [("a.mp4", ["-filter_complex", "overlay", "-vf", "scale=-2:720"]), ("b.mp4", [])]
+    assert ffmpegp.build_output_args(args, outputs) == [
+        "-i", "in.mp4", "-i", "logo.png",
+        "-filter_complex", "overlay", "-vf", "scale=-2:720", "a.mp4",
+        "b.mp4",
+    ]
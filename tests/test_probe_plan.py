@@ -0,0 +1,50 @@
+import json
+import subprocess
+
+import ffmpegp
+
+
+def test_format_entries():
+    assert ffmpegp.plan_probe("format.duration") == ["-show_entries", "format=duration"]
+    assert ffmpegp.plan_probe("$.format") == ["-show_entries", "format"]
+    assert ffmpegp.plan_probe("format.tags.title") == ["-probesize", "32768", "-analyzeduration", "0", "-show_entries", "format_tags=title"]
+    assert ffmpegp.plan_probe("format.format_name") == ["-probesize", "32768", "-analyzeduration", "0", "-show_entries", "format=format_name"]
+
+
+def test_stream_entries():
+    assert ffmpegp.plan_probe("streams[0].codec_name") == ["-show_entries", "stream=codec_name"]
+    assert ffmpegp.plan_probe("streams") == ["-show_entries", "stream"]
+    assert ffmpegp.plan_probe("streams[1].tags.language") == ["-show_entries", "stream_tags=language"]
+    assert ffmpegp.plan_probe("streams[0].disposition") == ["-show_entries", "stream_disposition"]
+
+
+def test_unplanned_paths_need_a_full_probe():
+    for json_path in ("streams[*].codec_name", "$..duration", "chapters[0].start", "programs"):
+        assert ffmpegp.plan_probe(json_path) is None, json_path
+
+
+def test_planned_results_are_cached(tmp_path, monkeypatch):
+    media = tmp_path / "in.mp4"
+    media.write_bytes(b"\0")
+    calls = []
+
+    def run(command, **kwargs):
+        calls.append(command)
+        key = command[command.index("-show_entries") + 1].split("=")[1]
+        return subprocess.CompletedProcess(command, 0, json.dumps({"format": {key: "2.000000"}}), "")
+
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(ffmpegp, "probe_cache", ffmpegp.ProbeCache(str(tmp_path / "probe.sqlite3")))
+
+    for _ in range(3):
+        assert ffmpegp.query_media(str(media), "format.duration") == ["2.000000"]
+    assert calls == [["ffprobe", "-v", "quiet", "-print_format", "json", "-show_entries", "format=duration", str(media)]]
+
+    # Other selections are probed on their own
+    ffmpegp.query_media(str(media), "format.size")
+    assert len(calls) == 2
+
+    # A changed file is probed again
+    media.write_bytes(b"\0\0")
+    ffmpegp.query_media(str(media), "format.duration")
+    assert len(calls) == 3
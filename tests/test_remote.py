@@ -0,0 +1,44 @@
+import os
+import sys
+import shutil
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(
+    os.name != "posix" or not shutil.which("ffmpeg") or not shutil.which("ffprobe"),
+    reason="ffmpeg and ffprobe are not installed",
+)
+
+# Stands in for ssh: runs the remote script locally, starting in another "login" directory
+SSH_STUB = """#!/bin/sh
+while [ "$#" -gt 2 ]; do shift; done
+echo "$1" >> "$STUB_LOG"
+cd "$STUB_HOME" && exec sh -c "$2"
+"""
+
+
+def test_hosts_run_in_the_local_working_directory(tmp_path):
+    videos = tmp_path / "videos"
+    home = tmp_path / "home"
+    videos.mkdir()
+    home.mkdir()
+    (tmp_path / "output").mkdir()
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=duration=1:size=64x64", str(videos / "a.mp4")], check=True)
+
+    ssh = tmp_path / "ssh"
+    ssh.write_text(SSH_STUB)
+    ssh.chmod(0o755)
+
+    env = dict(os.environ, PYTHONPATH=ROOT, STUB_HOME=str(home), STUB_LOG=str(tmp_path / "hosts.log"))
+    result = subprocess.run(
+        [sys.executable, "-m", "ffmpegp", "-i", "{}", "-c:v", "mpeg4", "output/{}.mkv", "--dir=videos", f"--ssh={ssh}", "--hosts=render1", "--stdout"],
+        cwd=tmp_path, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True,
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (tmp_path / "hosts.log").read_text().split() == ["render1"]
+    assert (tmp_path / "output" / "a.mkv").is_file()
+    assert not (home / "output").exists()
@@ -0,0 +1,30 @@
+import subprocess
+
+import ffmpegp
+
+
+def fake_ffprobe(monkeypatch, keyframes):
+    calls = []
+
+    def run(command, **kwargs):
+        calls.append(command)
+        lines = [f"{pts_time:.6f},K__" for pts_time in keyframes]
+        return subprocess.CompletedProcess(command, 0, "\n".join(lines), "")
+
+    monkeypatch.setattr(subprocess, "run", run)
+    return calls
+
+
+def test_cuts_on_keyframes(monkeypatch):
+    calls = fake_ffprobe(monkeypatch, [0, 2, 4, 6, 8, 10])
+
+    assert ffmpegp.get_keyframe_cuts("in.mp4", 12, 3) == [4, 8]
+    assert calls[0][calls[0].index("-read_intervals") + 1] == "4.000%+10,8.000%+10"
+
+
+def test_cuts_are_relative_to_start_time(monkeypatch):
+    # MPEG-TS inputs usually start at a non-zero timestamp, while input -ss counts from the start
+    calls = fake_ffprobe(monkeypatch, [1400.5, 1402.5, 1404.5, 1406.5, 1408.5, 1410.5])
+
+    assert ffmpegp.get_keyframe_cuts("in.ts", 12, 3, start_time=1400.5) == [4, 8]
+    assert calls[0][calls[0].index("-read_intervals") + 1] == "1404.500%+10,1408.500%+10"
@@ -0,0 +1,50 @@
+import os
+import re
+import sys
+import subprocess
+import tempfile
+
+# Budget for the cumulative `python -X importtime` cost of `import ffmpegp`, in microseconds.
+IMPORT_BUDGET_US = 20_000
+
+# Modules that must only be imported on first use, never by `import ffmpegp`.
+LAZY_MODULES = ["json", "sqlite3", "subprocess", "jsonpath_ng", "concurrent.futures", "asyncio"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, pycache):
+    # An empty PATH also checks that importing does not look for (or exit without) ffmpeg.
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONPYCACHEPREFIX=pycache, PATH="")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True)
+
+
+def test_import_time():
+    with tempfile.TemporaryDirectory() as pycache:
+        # The first run only writes the bytecode cache
+        run_python("import ffmpegp", pycache)
+        result = run_python("import ffmpegp", pycache)
+
+    assert result.returncode == 0, result.stderr
+    match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| ffmpegp$", result.stderr, re.MULTILINE)
+    assert match, result.stderr
+
+    cumulative = int(match.group(1))
+    assert cumulative <= IMPORT_BUDGET_US, f"import ffmpegp took {cumulative}us (budget {IMPORT_BUDGET_US}us)"
+
+
+def test_import_is_lazy():
+    code = f"import sys, ffmpegp; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+
+    with tempfile.TemporaryDirectory() as pycache:
+        result = run_python(code, pycache)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "", f"imported eagerly: {result.stdout.strip()}"
+
+
+if __name__ == "__main__":
+    test_import_time()
+    test_import_is_lazy()
+    print("Startup checks passed.")